@@ -0,0 +1,140 @@
+#  ==================================================================================
+#  代码描述：离线批量计算视差图/深度图。读取左右图片目录，在进程池中完成
+#           校正 -> SGBM匹配 -> WLS滤波（可选）-> 保存原始结果，用于批量重新处理录制数据
+#  运   行:
+#      python batchDepth.py --dirL left --dirR right --calibFile stereoCalibParam.yml --output disparity
+#      python batchDepth.py --dirL left --dirR right --calibFile stereoCalibParam.yml --output depth --workers 8
+#  ==================================================================================
+
+import os
+import time
+import argparse
+import numpy as np
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+from calibrationStore import loadStereoImages
+from rectifier import StereoRectifier
+from disparity import createSGBM, DisparityEngine
+from depth import DepthConverter, disparityRange
+
+# 输出类型对应的扩展名
+OUTPUTS = {
+    'disparity': '.png',    # 16位PNG，视差*16（SGBM原始定点值），无效视差为0
+    'depth': '.tiff',       # 32位浮点TIFF，单位：米，无效深度为0
+}
+
+# 每个工作进程中的校正器、视差引擎和深度转换器，由_initWorker创建一次
+_worker = {}
+
+
+def _initWorker(calibFile, minDisparity, numDisparities, blockSize, useWls, lmbda, sigma, unitScale):
+    # 进程之间已经并行，避免每个进程再开启OpenCV内部线程导致CPU超额订阅
+    cv2.setNumThreads(1)
+    # 映射表由第一次调用计算并缓存在./RectifyCache中，其余进程直接以内存映射方式加载
+    rectifier = StereoRectifier.fromCalibration(calibFile, mapType=cv2.CV_16SC2)
+    matcher = createSGBM(minDisparity, numDisparities, blockSize)
+    _worker['rectifier'] = rectifier
+    _worker['engine'] = DisparityEngine(matcher, useWls=useWls, lmbda=lmbda, sigma=sigma, parallel=False)
+    # 不大于该值的视差保存为0
+    _worker['invalid'] = max((minDisparity - 1) * 16, 0)
+    _worker['depth'] = DepthConverter(rectifier.Q, unitScale=unitScale, minDisparity=minDisparity)
+
+
+def _process(args):
+    index, imageL, imageR, outPath, output = args
+    t0 = time.perf_counter()
+    grayL = cv2.imread(imageL, cv2.IMREAD_GRAYSCALE)
+    grayR = cv2.imread(imageR, cv2.IMREAD_GRAYSCALE)
+    if grayL is None or grayR is None:
+        return index, False, time.perf_counter() - t0
+    rectifier = _worker['rectifier']
+    grayL, grayR = rectifier.remap(grayL, grayR)
+    filtered = _worker['engine'].compute(grayL, grayR)[0]
+    if output == 'depth':
+        ok = cv2.imwrite(outPath, _worker['depth'].compute(filtered))
+    else:
+        # 匹配器把无效像素标记为 (minDisparity-1)*16，与非正视差一起保存为0
+        ok = cv2.imwrite(outPath, np.where(filtered > _worker['invalid'], filtered, 0).astype(np.uint16))
+    return index, bool(ok), time.perf_counter() - t0
+
+
+def batchDepth(dirL, dirR, imageFormat, calibFile, output='disparity', savePath='DepthData', minDisparity=2, numDisparities=128, blockSize=3, useWls=True, lmbda=80000, sigma=1.8, unitScale=0.001, workers=None, maxInFlight=None, workingDistance=None):
+    '''
+    批量计算视差图或深度图\n
+    参数：\n
+        calibFile：双目标定文件 (stereoCalibParam.yml)\n
+        output：disparity保存16位定点视差PNG，depth保存以米为单位的float32 TIFF\n
+        savePath：输出文件夹，文件名与左图相同\n
+        minDisparity, numDisparities, blockSize：SGBM参数，默认与main.py相同\n
+        useWls, lmbda, sigma：是否使用WLS滤波及其参数\n
+        unitScale：标定单位到米的换算系数，棋盘格尺寸以毫米为单位时为0.001\n
+        workers：进程数，默认为CPU核数\n
+        maxInFlight：同时处理的图片对数量上限，默认为2*workers\n
+        workingDistance：工作距离范围 (最近, 最远)，单位米，给定时由Q矩阵计算minDisparity和numDisparities\n
+    返回：(成功数, 失败数)
+    '''
+    pairs = list(loadStereoImages(dirL, dirR, imageFormat))
+    os.makedirs(savePath, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    maxInFlight = maxInFlight or 2 * workers
+    extension = OUTPUTS[output]
+    tasks = []
+    for index, (imageL, imageR) in enumerate(pairs):
+        name = os.path.splitext(os.path.basename(imageL))[0]
+        tasks.append((index, imageL, imageR, savePath + '/' + name + extension, output))
+
+    # 先在主进程中计算并缓存映射表，避免多个工作进程同时计算
+    rectifier = StereoRectifier.fromCalibration(calibFile)
+    if workingDistance is not None:
+        minDisparity, numDisparities = disparityRange(rectifier.Q, workingDistance[0], workingDistance[1], unitScale)
+        print("工作距离 {} - {} m，视差搜索范围 [{}, {})".format(workingDistance[0], workingDistance[1], minDisparity, minDisparity + numDisparities))
+
+    print("开始批量计算{}，共 {} 对图片，进程数: {}".format(output, len(tasks), workers))
+    t0 = time.perf_counter()
+    done = failed = 0
+    busy = 0.0
+    initargs = (calibFile, minDisparity, numDisparities, blockSize, useWls, lmbda, sigma, unitScale)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=initargs) as pool:
+        # 最多同时提交maxInFlight对图片，内存占用与图片总数无关
+        futures = []
+        for i, task in enumerate(tasks):
+            futures.append(pool.submit(_process, task))
+            while len(futures) >= maxInFlight or (i == len(tasks) - 1 and futures):
+                index, ok, seconds = futures.pop(0).result()
+                done += 1
+                busy += seconds
+                if not ok:
+                    failed += 1
+                    print("图片对：" + tasks[index][1] + " " + tasks[index][2] + " 处理失败")
+                if done % 50 == 0 or done == len(tasks):
+                    elapsed = time.perf_counter() - t0
+                    remaining = (len(tasks) - done) * elapsed / done
+                    print("已处理 {}/{} 对图片，失败 {}，{:.2f} 对/秒，单对平均 {:.0f}ms，预计剩余 {:.0f}s".format(
+                        done, len(tasks), failed, done / elapsed, busy / done * 1000, remaining))
+    return done - failed, failed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Batch disparity / depth map generation')
+    parser.add_argument('--dirL', type=str, required=True, help='left images directory path')
+    parser.add_argument('--dirR', type=str, required=True, help='right images directory path')
+    parser.add_argument('--imageFormat', type=str, required=False, default='png', help='image format, png/jpg')
+    parser.add_argument('--calibFile', type=str, required=False, default='stereoCalibParam.yml', help='stereo calibration file')
+    parser.add_argument('--output', type=str, required=False, default='disparity', choices=list(OUTPUTS), help='disparity (16-bit PNG, disparity*16) or depth (float32 TIFF, meters)')
+    parser.add_argument('--savePath', type=str, required=False, default='DepthData', help='output folder')
+    parser.add_argument('--minDisparity', type=int, required=False, default=2, help='SGBM minDisparity')
+    parser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities, multiple of 16')
+    parser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+    parser.add_argument('--noWls', action='store_true', help='disable the right matcher and WLS filter')
+    parser.add_argument('--lmbda', type=float, required=False, default=80000, help='WLS lambda')
+    parser.add_argument('--sigma', type=float, required=False, default=1.8, help='WLS sigma color')
+    parser.add_argument('--unitScale', type=float, required=False, default=0.001, help='calibration unit to meters, 0.001 for millimeters')
+    parser.add_argument('--minDistance', type=float, required=False, default=None, help='nearest working distance in meters, derives the disparity range from Q')
+    parser.add_argument('--maxDistance', type=float, required=False, default=None, help='farthest working distance in meters, used with --minDistance (infinity when omitted)')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='number of worker processes, default is the CPU count')
+    args = parser.parse_args()
+
+    batchDepth(args.dirL, args.dirR, args.imageFormat, args.calibFile, args.output, args.savePath, args.minDisparity, args.numDisparities,
+               args.blockSize, not args.noWls, args.lmbda, args.sigma, args.unitScale, args.workers,
+               workingDistance=None if args.minDistance is None else (args.minDistance, args.maxDistance))
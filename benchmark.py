@@ -0,0 +1,559 @@
+#  ==================================================================================
+#  代码描述：双目测距相关的性能测试
+#  运   行:
+#      python benchmark.py remap --width 1280 --height 720
+#      python benchmark.py match --width 1280 --height 720
+#      python benchmark.py tiled --strips 2 4 8
+#      python benchmark.py pyramid --dirL RectifyDataStereo/left --dirR RectifyDataStereo/right
+#      python benchmark.py backends --backends bm sgbm 3way --filters wls none fill
+#      python benchmark.py stages --resolutions 640x360 1280x720 --numDisparities 64 128 --output bench_stages.json
+#      python benchmark.py alloc --width 1280 --height 720
+#      python benchmark.py temporal --frames 60 --motion 4
+#  ==================================================================================
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+import cv2
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+from rectifier import StereoRectifier, MAP_TYPES
+from disparity import createSGBM, createMatcher, DisparityEngine, TemporalReuse, SGBM_MODES, MATCHER_BACKENDS
+from depth import DepthConverter
+from calibrationStore import loadStereoImages
+from frameSource import syntheticPair, SyntheticSource, ImageDirSource, splitSideBySide
+from pipeline import FramePacket
+from stages import StereoStages, makeBuffers
+
+
+def syntheticMaps(imageSize):
+    """ 生成与真实相机相近的校正映射表，用于没有标定文件时的测试 """
+    w, h = imageSize
+    K = np.array([[w * 0.8, 0, w / 2], [0, w * 0.8, h / 2], [0, 0, 1]], np.float64)
+    D = np.array([[-0.05, 0.12, 0.001, -0.001, 0.0]], np.float64)
+    R = cv2.Rodrigues(np.array([0.01, -0.02, 0.005]))[0]
+    mapx, mapy = cv2.initUndistortRectifyMap(K, D, R, K, imageSize, cv2.CV_32FC1)
+    return mapx, mapy
+
+
+def benchmarkRemap(imageSize=(1280, 720), iterations=100, calibFile=None):
+    """ 比较不同映射表格式下remap的吞吐量 """
+    if calibFile:
+        rectifier = StereoRectifier.fromFile(calibFile, cv2.CV_32FC1)
+        mapx, mapy = rectifier.mapL
+        imageSize = rectifier.imageSize
+    else:
+        mapx, mapy = syntheticMaps(imageSize)
+    image = np.random.randint(0, 256, (imageSize[1], imageSize[0], 3), np.uint8)
+
+    results = {}
+    for name, mapType in MAP_TYPES.items():
+        rectifier = StereoRectifier(mapx, mapy, mapx, mapy, mapType)
+        dst = rectifier.remapLeft(image)
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            rectifier.remapLeft(image, dst)
+        elapsed = (time.perf_counter() - t0) / iterations
+        results[name] = elapsed
+        print('{:>6}: {:7.3f} ms/帧  {:7.1f} 帧/秒'.format(name, elapsed * 1000, 1.0 / elapsed))
+
+    # 校正彩色图像后转灰度 与 先转灰度再校正单通道 的对比（CV_16SC2）
+    rectifier = StereoRectifier(mapx, mapy, mapx, mapy, cv2.CV_16SC2)
+    color = rectifier.remapLeft(image)
+    gray = np.empty(image.shape[:2], np.uint8)
+    grayRect = np.empty(image.shape[:2], np.uint8)
+    colorFirst = timeit(lambda: cv2.cvtColor(rectifier.remapLeft(image, color), cv2.COLOR_BGR2GRAY, gray), iterations)
+    grayFirst = timeit(lambda: rectifier.remapLeft(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, gray), grayRect), iterations)
+    diff = np.abs(cv2.cvtColor(rectifier.remapLeft(image), cv2.COLOR_BGR2GRAY).astype(np.int16) - grayRect.astype(np.int16))
+    results['colorFirst'] = colorFirst
+    results['grayFirst'] = grayFirst
+    print('彩色校正+转灰度: {:7.3f} ms/帧  转灰度+单通道校正: {:7.3f} ms/帧  x{:.2f}  最大灰度差 {}'.format(
+        colorFirst * 1000, grayFirst * 1000, colorFirst / grayFirst, diff.max()))
+    return results
+
+
+def timeit(func, iterations):
+    func()
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - t0) / iterations
+
+
+def benchmarkParallelMatch(imageSize=(1280, 720), iterations=10, numDisparities=128, blockSize=3):
+    """ 比较左右匹配串行与并行执行的耗时 """
+    grayL, grayR, _ = syntheticPair(imageSize)
+    results = {}
+    for parallel in [False, True]:
+        engine = DisparityEngine(createSGBM(numDisparities=numDisparities, blockSize=blockSize), parallel=parallel)
+        name = 'parallel' if parallel else 'serial'
+        results[name] = timeit(lambda: engine.compute(grayL, grayR), iterations)
+        engine.close()
+        print('{:>8}: {:8.2f} ms/帧'.format(name, results[name] * 1000))
+    print('加速比: {:.2f}x (cv2线程数: {})'.format(results['serial'] / results['parallel'], cv2.getNumThreads()))
+    return results
+
+
+def disparityDiff(disp, reference, threshold=1.0):
+    """ 两张int16视差图之间的差异：(差异超过threshold像素的比例, 最大差异像素) """
+    diff = np.abs(disp.astype(np.float32) - reference.astype(np.float32)) / 16
+    return float((diff > threshold).mean()), float(diff.max())
+
+
+def benchmarkTiled(imageSize=(1280, 720), iterations=5, numDisparities=128, blockSize=3, stripsList=(2, 4, 8), overlap=None):
+    '''
+    比较单次匹配与条带分块匹配的DisparityEngine（与main.py相同，右匹配器 + WLS滤波）的耗时，
+    并检查左视差和WLS滤波结果与单次匹配引擎的像素差异
+    '''
+    grayL, grayR, _ = syntheticPair(imageSize)
+    single = DisparityEngine(createSGBM(numDisparities=numDisparities, blockSize=blockSize), useWls=True, parallel=False)
+    filtered, dispL, _ = single.compute(grayL, grayR)
+    reference, referenceL = filtered.copy(), dispL.copy()
+    baseline = timeit(lambda: single.compute(grayL, grayR), iterations)
+    single.close()
+    print('{:>8}: {:8.2f} ms/帧'.format('single', baseline * 1000))
+    results = {'single': {'time': baseline}}
+    for strips in stripsList:
+        tiled = DisparityEngine(createSGBM(numDisparities=numDisparities, blockSize=blockSize), useWls=True, parallel=False, strips=strips, overlap=overlap)
+        elapsed = timeit(lambda: tiled.compute(grayL, grayR), iterations)
+        filtered, dispL, _ = tiled.compute(grayL, grayR)
+        ratioL, maxDiffL = disparityDiff(dispL, referenceL)
+        ratio, maxDiff = disparityDiff(filtered, reference)
+        tiled.close()
+        results['strips{}'.format(strips)] = {'time': elapsed, 'diffRatioL': ratioL, 'maxDiffL': maxDiffL, 'diffRatio': ratio, 'maxDiff': maxDiff}
+        print('{:>8}: {:8.2f} ms/帧  加速比 {:.2f}x  左视差差异>1px像素 {:.4%}  滤波结果差异>1px像素 {:.4%}  最大差异 {:.1f}px'.format(
+            'strips' + str(strips), elapsed * 1000, baseline / elapsed, ratioL, ratio, maxDiff))
+    return results
+
+
+def loadGrayPairs(dirL, dirR, imageFormat='png', limit=None):
+    """ 读取已校正的图像对并转换为灰度图 """
+    pairs = []
+    for imageL, imageR in loadStereoImages(dirL, dirR, imageFormat):
+        pairs.append((cv2.imread(imageL, cv2.IMREAD_GRAYSCALE), cv2.imread(imageR, cv2.IMREAD_GRAYSCALE)))
+        if limit and len(pairs) >= limit:
+            break
+    return pairs
+
+
+def disparityError(disp, reference, invalid, threshold=1.0):
+    '''
+    视差精度：(误差超过threshold像素的比例, 平均绝对误差, 有效像素比例)\n
+    reference为int16定点视差或真实视差（像素）；两者都有效的像素才参与误差统计
+    '''
+    reference = np.asarray(reference)
+    if reference.dtype == np.int16:
+        refValid = reference > invalid
+        reference = reference.astype(np.float32) / 16
+    else:
+        refValid = np.ones(reference.shape, bool)
+    valid = (disp > invalid) & refValid
+    if not valid.any():
+        return 1.0, float('nan'), 0.0
+    err = np.abs(disp[valid].astype(np.float32) / 16 - reference[valid])
+    return float((err > threshold).mean()), float(err.mean()), float(valid.sum()) / refValid.sum()
+
+
+def benchmarkPyramid(imageSize=(1280, 720), iterations=5, numDisparities=128, blockSize=3, scales=(0.5, 0.25), dirL='', dirR='', imageFormat='png', useWls=True):
+    '''
+    金字塔视差模式的速度与精度对比\n
+    给定dirL/dirR时使用录制的已校正图像对，以原分辨率的引擎结果为参考；否则使用带真实视差的合成图像对\n
+    useWls：与main.py相同使用右匹配器 + WLS滤波，默认为True
+    '''
+    def makeEngine(scale, refine):
+        # 每个引擎使用新的匹配器：WLS滤波器会修改匹配器的参数
+        matcher = createSGBM(numDisparities=numDisparities, blockSize=blockSize)
+        return DisparityEngine(matcher, useWls=useWls, parallel=False, pyramidScale=scale, refine=refine)
+
+    invalid = (createSGBM().getMinDisparity() - 1) * 16
+    if dirL and dirR:
+        full = makeEngine(1.0, False)
+        pairs = [(L, R, full.compute(L, R)[0].copy()) for L, R in loadGrayPairs(dirL, dirR, imageFormat, limit=iterations)]
+        full.close()
+    else:
+        pairs = [syntheticPair(imageSize, maxDisparity=min(numDisparities, 96), seed=i) for i in range(iterations)]
+
+    modes = [('full', 1.0, False)]
+    for scale in scales:
+        modes += [('x{}'.format(scale), scale, False), ('x{}+refine'.format(scale), scale, True)]
+
+    results = {}
+    for name, scale, refine in modes:
+        engine = makeEngine(scale, refine)
+        engine.compute(pairs[0][0], pairs[0][1])
+        elapsed, bad, mae, density = 0.0, [], [], []
+        for L, R, reference in pairs:
+            t0 = time.perf_counter()
+            disp = engine.compute(L, R)[0]
+            elapsed += time.perf_counter() - t0
+            stats = disparityError(disp, reference, invalid)
+            bad.append(stats[0])
+            mae.append(stats[1])
+            density.append(stats[2])
+        engine.close()
+        elapsed /= len(pairs)
+        results[name] = {'time': elapsed, 'bad1': float(np.mean(bad)), 'mae': float(np.nanmean(mae)), 'density': float(np.mean(density))}
+        print('{:>14}: {:8.2f} ms/帧  误差>1px {:7.2%}  平均误差 {:6.3f}px  有效像素 {:7.2%}'.format(
+            name, elapsed * 1000, results[name]['bad1'], results[name]['mae'], results[name]['density']))
+    return results
+
+
+def benchmarkBackends(imageSize=(1280, 720), iterations=5, numDisparities=128, blockSize=3, bmBlockSize=9, backends=MATCHER_BACKENDS,
+                      filters=('wls', 'none', 'median', 'fill'), dirL='', dirR='', imageFormat='png'):
+    '''
+    各匹配器后端与后处理组合的速度与精度对比，所有组合使用相同的图像对\n
+    给定dirL/dirR时使用录制的已校正图像对，以原分辨率SGBM左视差为参考；否则使用带真实视差的合成图像对\n
+    filters：wls 右匹配 + WLS滤波，none/median/fill 只计算左视差，见disparity.POST_FILTERS
+    '''
+    if dirL and dirR:
+        reference = createSGBM(numDisparities=numDisparities, blockSize=blockSize)
+        pairs = [(L, R, reference.compute(L, R)) for L, R in loadGrayPairs(dirL, dirR, imageFormat, limit=iterations)]
+    else:
+        pairs = [syntheticPair(imageSize, maxDisparity=min(numDisparities, 96), seed=i) for i in range(iterations)]
+
+    results = {}
+    for backend, postFilter in itertools.product(backends, filters):
+        matcher = createMatcher(backend, numDisparities=numDisparities, blockSize=bmBlockSize if backend == 'bm' else blockSize)
+        invalid = (matcher.getMinDisparity() - 1) * 16
+        engine = DisparityEngine(matcher, useWls=postFilter == 'wls', parallel=False,
+                                 postFilter=None if postFilter in ('wls', 'none') else postFilter)
+        engine.compute(pairs[0][0], pairs[0][1])
+        elapsed, bad, mae, density = 0.0, [], [], []
+        for L, R, reference in pairs:
+            t0 = time.perf_counter()
+            disp = engine.compute(L, R)[0]
+            elapsed += time.perf_counter() - t0
+            stats = disparityError(disp, reference, invalid)
+            bad.append(stats[0])
+            mae.append(stats[1])
+            density.append(stats[2])
+        engine.close()
+        elapsed /= len(pairs)
+        name = '{}+{}'.format(backend, postFilter)
+        results[name] = {'time': elapsed, 'bad1': float(np.mean(bad)), 'mae': float(np.nanmean(mae)), 'density': float(np.mean(density))}
+        print('{:>14}: {:8.2f} ms/帧  误差>1px {:7.2%}  平均误差 {:6.3f}px  有效像素 {:7.2%}'.format(
+            name, elapsed * 1000, results[name]['bad1'], results[name]['mae'], results[name]['density']))
+    return results
+
+
+class StageTimer(object):
+    """ 记录每个阶段每帧的耗时 """
+
+    def __init__(self):
+        self.times = {}
+
+    def run(self, name, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.times.setdefault(name, []).append(time.perf_counter() - t0)
+        return result
+
+    def summary(self):
+        """ 每个阶段的 p50/p95/p99/平均耗时，单位毫秒 """
+        result = {}
+        for name, times in self.times.items():
+            p50, p95, p99 = np.percentile(np.array(times) * 1000, [50, 95, 99])
+            result[name] = {'p50': p50, 'p95': p95, 'p99': p99, 'mean': float(np.mean(times)) * 1000}
+        return result
+
+
+def syntheticQ(imageSize):
+    """ 与syntheticMaps配套的重投影矩阵，用于没有标定文件时的深度计算 """
+    w, h = imageSize
+    return np.float64([[1, 0, 0, -w / 2], [0, 1, 0, -h / 2], [0, 0, 0, w * 0.8], [0, 0, 1 / 60.0, 0]])
+
+
+def runStages(stages, frameL, frameR, buffers=None, timer=None):
+    """ 用main.py的处理阶段（stages.StereoStages）处理一帧，timer给定时每个阶段单独计时（不含imshow）；阶段内每一步的计时见StereoStages.timer """
+    packet = FramePacket(0, time.perf_counter(), frameL, frameR)
+    if buffers is not None:
+        packet.buffers = buffers
+    for name, func in stages.stages():
+        packet = func(packet) if timer is None else timer.run(name, func, packet)
+    return packet
+
+
+def benchmarkAlloc(imageSize=(1280, 720), frames=20, numDisparities=128, blockSize=3):
+    '''
+    对比每帧分配新数组与写入预分配缓冲区两种方式的每帧内存分配量和耗时\n
+    分配量为tracemalloc统计的每帧峰值新增内存（numpy数组和OpenCV输出的图像都会被统计，
+    OpenCV内部的临时缓冲区不在其中）
+    '''
+    minDisparity = 2
+    source = SyntheticSource(imageSize)
+    # 左右图为拼接帧的视图，与相机采集时相同
+    frameList = [np.hstack(source.read()[2:]) for _ in range(frames)]
+    mapx, mapy = syntheticMaps(imageSize)
+    rectifier = StereoRectifier(mapx, mapy, mapx, mapy, cv2.CV_16SC2)
+    engine = DisparityEngine(createSGBM(minDisparity, numDisparities, blockSize), useWls=True)
+    stages = StereoStages(rectifier, engine, DepthConverter(syntheticQ(imageSize), minDisparity=minDisparity), minDisparity, numDisparities)
+    buf = makeBuffers((imageSize[1], imageSize[0], 3))
+
+    def allocating(frameL, frameR):
+        runStages(stages, frameL, frameR)
+
+    def preallocated(frameL, frameR):
+        runStages(stages, frameL, frameR, buf)
+
+    print('分辨率 {}x{}，{} 帧'.format(imageSize[0], imageSize[1], frames))
+    for name, func in [('allocating', allocating), ('preallocated', preallocated)]:
+        # 预热一帧，不计入统计
+        func(*splitSideBySide(frameList[0]))
+        peaks = []
+        times = []
+        tracemalloc.start()
+        for frame in frameList:
+            frameL, frameR = splitSideBySide(frame)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            t0 = time.perf_counter()
+            func(frameL, frameR)
+            times.append(time.perf_counter() - t0)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        print('{:>13}: 每帧分配 {:10.1f}KB  平均 {:7.2f}ms'.format(name, np.mean(peaks) / 1024.0, np.mean(times) * 1000))
+    engine.close()
+
+
+def benchmarkTemporal(imageSize=(1280, 720), frames=60, motion=4, numDisparities=128, blockSize=3, refreshInterval=30, tileSize=32):
+    '''
+    对比每帧完整计算与时间复用（只重新计算变化区域）的耗时和结果差异\n
+    合成序列中背景静止，前景矩形每帧水平移动motion像素
+    '''
+    minDisparity = 2
+    pairs = [syntheticPair(imageSize, shift=i * motion)[:2] for i in range(frames)]
+    full = DisparityEngine(createSGBM(minDisparity, numDisparities, blockSize), useWls=True, parallel=False)
+    temporal = TemporalReuse(DisparityEngine(createSGBM(minDisparity, numDisparities, blockSize), useWls=True, parallel=False),
+                             tileSize=tileSize, refreshInterval=refreshInterval)
+    fullTimes, reuseTimes, changes, diffs = [], [], [], []
+    for grayL, grayR in pairs:
+        t0 = time.perf_counter()
+        reference = full.compute(grayL, grayR)[0]
+        fullTimes.append(time.perf_counter() - t0)
+        filtered = temporal.compute(grayL, grayR)[0]
+        reuseTimes.append(temporal.last['time'])
+        changes.append(temporal.last['rowRatio'])
+        diffs.append(disparityDiff(filtered, reference)[0])
+    full.close()
+    temporal.close()
+    # 第一帧两者都是完整计算，不计入统计
+    print('分辨率 {}x{}，{} 帧，每帧移动 {} 像素，完整计算间隔 {} 帧'.format(imageSize[0], imageSize[1], frames, motion, refreshInterval))
+    print('  完整计算: 平均 {:7.2f}ms'.format(np.mean(fullTimes[1:]) * 1000))
+    print('  时间复用: 平均 {:7.2f}ms  重算行 {:.0%}  x{:.2f}  与完整计算相差>1px的像素 {:.2%}'.format(
+        np.mean(reuseTimes[1:]) * 1000, np.mean(changes[1:]), np.mean(fullTimes[1:]) / np.mean(reuseTimes[1:]), np.mean(diffs[1:])))
+
+
+def benchmarkStages(resolutions=((1280, 720),), numDisparitiesList=(128,), blockSizes=(3,), modes=('sgbm',), frames=30, dirL='', dirR='', imageFormat='png', output='bench_stages.json', compare='', calibFile='stereoCalibParam.yml'):
+    '''
+    无界面运行main.py的处理流程，统计各阶段p50/p95/p99耗时、帧率和峰值内存，结果写入JSON文件\n
+    参数：\n
+        resolutions：合成数据的分辨率列表；给定dirL/dirR时使用录制图像的原始分辨率\n
+        calibFile：录制图像的双目标定文件，合成数据使用合成的映射表\n
+        numDisparitiesList, blockSizes, modes：SGBM参数，逐一组合测试\n
+        frames：每组参数处理的帧数\n
+        output：结果文件\n
+        compare：之前的结果文件，给定时输出各阶段p50的变化
+    '''
+    minDisparity = 2
+    runs = []
+    if dirL and dirR:
+        resolutions = [None]
+    for size, numDisparities, blockSize, mode in itertools.product(resolutions, numDisparitiesList, blockSizes, modes):
+        if size is None:
+            source = ImageDirSource(dirL, dirR, imageFormat, loop=True)
+        else:
+            source = SyntheticSource(size)
+        frameList = [source.read()[2:] for _ in range(frames)]
+        h, w = frameList[0][0].shape[:2]
+        if size is None:
+            # 录制的图像使用其标定参数校正
+            rectifier = StereoRectifier.fromCalibration(calibFile, mapType=cv2.CV_16SC2)
+            if rectifier.imageSize != (w, h):
+                raise ValueError('录制图像尺寸 {}x{} 与标定尺寸 {}x{} 不一致'.format(w, h, *rectifier.imageSize))
+            Q = rectifier.Q
+        else:
+            mapx, mapy = syntheticMaps((w, h))
+            rectifier = StereoRectifier(mapx, mapy, mapx, mapy, cv2.CV_16SC2)
+            Q = syntheticQ((w, h))
+        # 与main.py的默认设置相同：先转灰度再校正，左右匹配并行，WLS滤波，预分配缓冲区
+        engine = DisparityEngine(createSGBM(minDisparity, numDisparities, blockSize, SGBM_MODES[mode]), useWls=True)
+        stages = StereoStages(rectifier, engine, DepthConverter(Q, minDisparity=minDisparity), minDisparity, numDisparities)
+        buf = makeBuffers(frameList[0][0].shape)
+
+        # 预热一帧，不计入统计
+        runStages(stages, frameList[0][0], frameList[0][1], buf)
+        # 各阶段总耗时之外，阶段内的每一步（remap、cvtColor、左右SGBM、WLS、normalize、morphologyEx、applyColorMap等）也分别计时
+        timer = StageTimer()
+        stages.timer = engine.timer = timer
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        for frameL, frameR in frameList:
+            timer.run('frame', runStages, stages, frameL, frameR, buf, timer)
+        elapsed = time.perf_counter() - t0
+        _, peakTraced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        engine.close()
+
+        run = {'resolution': '{}x{}'.format(w, h), 'numDisparities': numDisparities, 'blockSize': blockSize, 'mode': mode,
+               'frames': frames, 'fps': frames / elapsed, 'stages': timer.summary(),
+               'peakTracedMB': peakTraced / 2.0 ** 20}
+        if resource is not None:
+            # ru_maxrss 在Linux上单位为KB，为进程启动以来的峰值
+            run['maxRssMB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        runs.append(run)
+        printStageRun(run)
+
+    result = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'opencv': cv2.__version__, 'numpy': np.__version__,
+                       'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                       'cvThreads': cv2.getNumThreads()},
+              'runs': runs}
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('结果已保存到 ' + output)
+    if compare:
+        compareStageRuns(compare, result)
+    return result
+
+
+def runKey(run):
+    return (run['resolution'], run['numDisparities'], run['blockSize'], run['mode'])
+
+
+def printStageRun(run):
+    print('\n{} numDisparities={} blockSize={} mode={}  {:.1f} 帧/秒  峰值内存(traced) {:.1f}MB'.format(
+        run['resolution'], run['numDisparities'], run['blockSize'], run['mode'], run['fps'], run['peakTracedMB']))
+    for name, s in run['stages'].items():
+        print('  {:>15}: p50 {:8.2f}ms  p95 {:8.2f}ms  p99 {:8.2f}ms'.format(name, s['p50'], s['p95'], s['p99']))
+
+
+def compareStageRuns(path, result):
+    """ 与之前的结果对比各阶段p50耗时，比值大于1表示变慢 """
+    with open(path) as f:
+        previous = {runKey(run): run for run in json.load(f)['runs']}
+    for run in result['runs']:
+        old = previous.get(runKey(run))
+        if old is None:
+            continue
+        print('\n对比 {} numDisparities={} blockSize={} mode={}'.format(*runKey(run)))
+        for name, s in run['stages'].items():
+            if name in old['stages']:
+                ratio = s['p50'] / max(old['stages'][name]['p50'], 1e-9)
+                print('  {:>15}: {:8.2f}ms -> {:8.2f}ms  x{:.2f}'.format(name, old['stages'][name]['p50'], s['p50'], ratio))
+
+
+def parseResolution(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stereo benchmark')
+    subparsers = parser.add_subparsers(dest='command')
+
+    remapParser = subparsers.add_parser('remap', help='compare remap throughput per map format')
+    remapParser.add_argument('--width', type=int, required=False, default=1280, help='image width')
+    remapParser.add_argument('--height', type=int, required=False, default=720, help='image height')
+    remapParser.add_argument('--iterations', type=int, required=False, default=100, help='number of remap calls per format')
+    remapParser.add_argument('--calibFile', type=str, required=False, default='', help='rectified YML file, synthetic maps are used when empty')
+
+    matchParser = subparsers.add_parser('match', help='compare serial and parallel left/right matching')
+    matchParser.add_argument('--width', type=int, required=False, default=1280, help='image width')
+    matchParser.add_argument('--height', type=int, required=False, default=720, help='image height')
+    matchParser.add_argument('--iterations', type=int, required=False, default=10, help='number of frames per mode')
+    matchParser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities')
+    matchParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+
+    tiledParser = subparsers.add_parser('tiled', help='compare the single-call engine with the strip-tiled engine (WLS on)')
+    tiledParser.add_argument('--width', type=int, required=False, default=1280, help='image width')
+    tiledParser.add_argument('--height', type=int, required=False, default=720, help='image height')
+    tiledParser.add_argument('--iterations', type=int, required=False, default=5, help='number of frames per mode')
+    tiledParser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities')
+    tiledParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+    tiledParser.add_argument('--strips', type=int, nargs='+', required=False, default=[2, 4, 8], help='strip counts to test')
+    tiledParser.add_argument('--overlap', type=int, required=False, default=None, help='rows of overlap per strip side')
+
+    pyramidParser = subparsers.add_parser('pyramid', help='speed and accuracy of coarse-to-fine disparity per scale')
+    pyramidParser.add_argument('--width', type=int, required=False, default=1280, help='synthetic image width')
+    pyramidParser.add_argument('--height', type=int, required=False, default=720, help='synthetic image height')
+    pyramidParser.add_argument('--iterations', type=int, required=False, default=5, help='number of image pairs')
+    pyramidParser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities')
+    pyramidParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+    pyramidParser.add_argument('--scales', type=float, nargs='+', required=False, default=[0.5, 0.25], help='pyramid scales to test')
+    pyramidParser.add_argument('--dirL', type=str, required=False, default='', help='left rectified images directory path, synthetic pairs are used when empty')
+    pyramidParser.add_argument('--dirR', type=str, required=False, default='', help='right rectified images directory path')
+    pyramidParser.add_argument('--imageFormat', type=str, required=False, default='png', help='image format, png/jpg')
+    pyramidParser.add_argument('--noWls', action='store_true', help='disable the right matcher and WLS filter')
+
+    backendsParser = subparsers.add_parser('backends', help='speed and accuracy of each matcher backend and post-filter on the same pairs')
+    backendsParser.add_argument('--width', type=int, required=False, default=1280, help='synthetic image width')
+    backendsParser.add_argument('--height', type=int, required=False, default=720, help='synthetic image height')
+    backendsParser.add_argument('--iterations', type=int, required=False, default=5, help='number of image pairs')
+    backendsParser.add_argument('--numDisparities', type=int, required=False, default=128, help='numDisparities, multiple of 16')
+    backendsParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+    backendsParser.add_argument('--bmBlockSize', type=int, required=False, default=9, help='StereoBM blockSize, odd and at least 5')
+    backendsParser.add_argument('--backends', type=str, nargs='+', required=False, default=MATCHER_BACKENDS, choices=MATCHER_BACKENDS, help='matcher backends')
+    backendsParser.add_argument('--filters', type=str, nargs='+', required=False, default=['wls', 'none', 'median', 'fill'],
+                                choices=['wls', 'none', 'median', 'fill'], help='post-filters')
+    backendsParser.add_argument('--dirL', type=str, required=False, default='', help='left rectified images directory path, synthetic pairs are used when empty')
+    backendsParser.add_argument('--dirR', type=str, required=False, default='', help='right rectified images directory path')
+    backendsParser.add_argument('--imageFormat', type=str, required=False, default='png', help='image format, png/jpg')
+
+    stagesParser = subparsers.add_parser('stages', help='per-stage latency of the main.py pipeline, written to JSON')
+    stagesParser.add_argument('--resolutions', type=str, nargs='+', required=False, default=['1280x720'], help='synthetic resolutions, e.g. 640x360 1280x720')
+    stagesParser.add_argument('--numDisparities', type=int, nargs='+', required=False, default=[128], help='SGBM numDisparities values')
+    stagesParser.add_argument('--blockSize', type=int, nargs='+', required=False, default=[3], help='SGBM blockSize values')
+    stagesParser.add_argument('--modes', type=str, nargs='+', required=False, default=['sgbm'], choices=list(SGBM_MODES), help='SGBM modes')
+    stagesParser.add_argument('--frames', type=int, required=False, default=30, help='frames per configuration')
+    stagesParser.add_argument('--dirL', type=str, required=False, default='', help='left recorded images directory path, synthetic pairs are used when empty')
+    stagesParser.add_argument('--dirR', type=str, required=False, default='', help='right recorded images directory path')
+    stagesParser.add_argument('--imageFormat', type=str, required=False, default='png', help='image format, png/jpg')
+    stagesParser.add_argument('--calibFile', type=str, required=False, default='stereoCalibParam.yml', help='stereo calibration file for recorded images')
+    stagesParser.add_argument('--output', type=str, required=False, default='bench_stages.json', help='JSON result file')
+    stagesParser.add_argument('--compare', type=str, required=False, default='', help='previous JSON result file to compare against')
+
+    allocParser = subparsers.add_parser('alloc', help='per-frame allocations with and without preallocated buffers')
+    allocParser.add_argument('--width', type=int, required=False, default=1280, help='image width')
+    allocParser.add_argument('--height', type=int, required=False, default=720, help='image height')
+    allocParser.add_argument('--frames', type=int, required=False, default=20, help='number of frames per mode')
+    allocParser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities')
+    allocParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+
+    temporalParser = subparsers.add_parser('temporal', help='full recompute vs reusing disparity in static regions')
+    temporalParser.add_argument('--width', type=int, required=False, default=1280, help='image width')
+    temporalParser.add_argument('--height', type=int, required=False, default=720, help='image height')
+    temporalParser.add_argument('--frames', type=int, required=False, default=60, help='number of frames')
+    temporalParser.add_argument('--motion', type=int, required=False, default=4, help='foreground motion per frame in pixels')
+    temporalParser.add_argument('--numDisparities', type=int, required=False, default=128, help='SGBM numDisparities')
+    temporalParser.add_argument('--blockSize', type=int, required=False, default=3, help='SGBM blockSize')
+    temporalParser.add_argument('--refresh', type=int, required=False, default=30, help='full refresh interval in frames')
+    temporalParser.add_argument('--tileSize', type=int, required=False, default=32, help='change detection tile size')
+
+    args = parser.parse_args()
+
+    if args.command == 'remap':
+        benchmarkRemap((args.width, args.height), args.iterations, args.calibFile)
+    elif args.command == 'match':
+        benchmarkParallelMatch((args.width, args.height), args.iterations, args.numDisparities, args.blockSize)
+    elif args.command == 'tiled':
+        benchmarkTiled((args.width, args.height), args.iterations, args.numDisparities, args.blockSize, args.strips, args.overlap)
+    elif args.command == 'pyramid':
+        benchmarkPyramid((args.width, args.height), args.iterations, args.numDisparities, args.blockSize, args.scales, args.dirL, args.dirR, args.imageFormat, not args.noWls)
+    elif args.command == 'backends':
+        benchmarkBackends((args.width, args.height), args.iterations, args.numDisparities, args.blockSize, args.bmBlockSize, args.backends,
+                          args.filters, args.dirL, args.dirR, args.imageFormat)
+    elif args.command == 'stages':
+        benchmarkStages([parseResolution(r) for r in args.resolutions], args.numDisparities, args.blockSize, args.modes,
+                        args.frames, args.dirL, args.dirR, args.imageFormat, args.output, args.compare, args.calibFile)
+    elif args.command == 'alloc':
+        benchmarkAlloc((args.width, args.height), args.frames, args.numDisparities, args.blockSize)
+    elif args.command == 'temporal':
+        benchmarkTemporal((args.width, args.height), args.frames, args.motion, args.numDisparities, args.blockSize, args.refresh, args.tileSize)
+    else:
+        parser.print_help()
@@ -0,0 +1,111 @@
+#  ==================================================================================
+#  代码描述：标定图片覆盖度统计。根据检测到的棋盘格角点计算棋盘格在图像中的位置、
+#           大小、倾斜程度以及图像平面网格覆盖率，只有带来新信息的视角才值得保存
+#  ==================================================================================
+
+import numpy as np
+
+
+def boardParams(corners, patternSize, imageSize):
+    '''
+    棋盘格姿态描述：[x, y, size, skew]，均归一化到 [0, 1]\n
+        x, y：棋盘格中心在图像中的位置\n
+        size：棋盘格面积占图像面积比例的平方根\n
+        skew：棋盘格倾斜程度，由外框左上角的夹角偏离90度的程度计算\n
+    参数：\n
+        corners：N x 1 x 2 角点坐标\n
+        patternSize：棋盘格角点数 (宽, 高)\n
+        imageSize：图像 (宽, 高)
+    '''
+    pts = np.asarray(corners, np.float64).reshape(-1, 2)
+    cols = patternSize[0]
+    w, h = imageSize
+    # 外框四个角：左上、右上、右下、左下
+    quad = np.array([pts[0], pts[cols - 1], pts[-1], pts[-cols]])
+    x, y = quad.mean(axis=0)
+    # 鞋带公式计算四边形面积
+    area = 0.5 * abs(np.dot(quad[:, 0], np.roll(quad[:, 1], 1)) - np.dot(quad[:, 1], np.roll(quad[:, 0], 1)))
+    size = np.sqrt(area / float(w * h))
+    right = quad[1] - quad[0]
+    down = quad[3] - quad[0]
+    cos = np.dot(right, down) / (np.linalg.norm(right) * np.linalg.norm(down) + 1e-12)
+    angle = np.arccos(np.clip(cos, -1.0, 1.0))
+    skew = min(1.0, 2.0 * abs(np.pi / 2 - angle))
+    return np.array([x / w, y / h, size, skew])
+
+
+class CoverageTracker(object):
+    '''
+    标定视角覆盖度统计\n
+    参数：\n
+        imageSize：图像 (宽, 高)\n
+        patternSize：棋盘格角点数 (宽, 高)\n
+        grid：图像平面覆盖网格 (列, 行)，默认为 (8, 6)\n
+        minDistance：新视角与已保存视角的姿态描述最小L1距离，默认为0.2\n
+        paramRanges：[x, y, size, skew] 各自需要覆盖的范围，默认为 [0.7, 0.7, 0.4, 0.5]\n
+        gridTarget：需要达到的网格覆盖率，默认为0.8\n
+        maxViews：最多保存的视角数，默认为40
+    '''
+
+    def __init__(self, imageSize, patternSize, grid=(8, 6), minDistance=0.2, paramRanges=(0.7, 0.7, 0.4, 0.5), gridTarget=0.8, maxViews=40):
+        self.imageSize = imageSize
+        self.patternSize = patternSize
+        self.grid = grid
+        self.minDistance = minDistance
+        self.paramRanges = np.array(paramRanges, np.float64)
+        self.gridTarget = gridTarget
+        self.maxViews = maxViews
+        self.params = []
+        self.covered = {}   # 每个相机的网格覆盖情况
+
+    def cells(self, corners):
+        """ 角点落入的网格单元，返回布尔数组 (行, 列) """
+        pts = np.asarray(corners, np.float64).reshape(-1, 2)
+        cols, rows = self.grid
+        cx = np.clip((pts[:, 0] * cols / self.imageSize[0]).astype(int), 0, cols - 1)
+        cy = np.clip((pts[:, 1] * rows / self.imageSize[1]).astype(int), 0, rows - 1)
+        mask = np.zeros((rows, cols), bool)
+        mask[cy, cx] = True
+        return mask
+
+    def isNovel(self, cornersList):
+        '''
+        判断一组角点（单目为[corners]，双目为[cornersL, cornersR]）是否带来新的覆盖\n
+        姿态与已保存视角都有足够差异，或覆盖了新的网格单元时返回True
+        '''
+        params = boardParams(cornersList[0], self.patternSize, self.imageSize)
+        if not self.params:
+            return True
+        distance = np.abs(np.array(self.params) - params).sum(axis=1).min()
+        if distance > self.minDistance:
+            return True
+        for camera, corners in enumerate(cornersList):
+            covered = self.covered.get(camera)
+            if covered is not None and (self.cells(corners) & ~covered).any():
+                return True
+        return False
+
+    def add(self, cornersList):
+        """ 记录一个已保存的视角 """
+        self.params.append(boardParams(cornersList[0], self.patternSize, self.imageSize))
+        for camera, corners in enumerate(cornersList):
+            covered = self.covered.get(camera, np.zeros((self.grid[1], self.grid[0]), bool))
+            self.covered[camera] = covered | self.cells(corners)
+
+    def progress(self):
+        """ 各项覆盖进度：{'x', 'y', 'size', 'skew', 'grid'}，均为 [0, 1] """
+        if not self.params:
+            return dict(x=0.0, y=0.0, size=0.0, skew=0.0, grid=0.0)
+        params = np.array(self.params)
+        spans = np.minimum((params.max(axis=0) - params.min(axis=0)) / self.paramRanges, 1.0)
+        grid = min(covered.mean() for covered in self.covered.values())
+        result = dict(zip(['x', 'y', 'size', 'skew'], spans.tolist()))
+        result['grid'] = min(grid / self.gridTarget, 1.0)
+        return result
+
+    def done(self):
+        """ 所有覆盖目标都已达到，或已达到最多视角数 """
+        return len(self.params) >= self.maxViews or min(self.progress().values()) >= 1.0
+
+    def report(self):
+        return '已保存 {} 张  '.format(len(self.params)) + '  '.join('{} {:.0%}'.format(k, v) for k, v in self.progress().items())
@@ -1,6 +1,11 @@
 import cv2
 import glob
+import os
 import sys
+import numpy as np
+
+# 映射表名称，对应保存文件中的节点名
+MAP_NAMES = ["MAPLX", "MAPLY", "MAPRX", "MAPRY"]
 
 
 def saveCoefficients(path, mtx, dist, rms):
@@ -13,8 +18,14 @@ def saveCoefficients(path, mtx, dist, rms):
     cv_file.release()
 
 
-def saveStereoCoefficients(path, imageSize, K1, D1, K2, D2, R, T, E, F, rms, R1=None, R2=None, P1=None, P2=None, Q=None, roiL=None, roiR=None, mapLx=None, mapLy=None, mapRx=None, mapRy=None):
-    """ Save the stereo coefficients to given path/file. """
+def saveStereoCoefficients(path, imageSize, K1, D1, K2, D2, R, T, E, F, rms, R1=None, R2=None, P1=None, P2=None, Q=None, roiL=None, roiR=None, mapLx=None, mapLy=None, mapRx=None, mapRy=None, mapFormat='yml'):
+    """ Save the stereo coefficients to given path/file.
+
+    mapFormat='yml' writes the remap tables into the YAML file itself, 'npy' keeps
+    the small matrices in YAML and writes each table as a raw .npy file next to it.
+    """
+    if mapFormat not in ('yml', 'npy'):
+        raise ValueError("mapFormat must be 'yml' or 'npy', got {!r}".format(mapFormat))
     cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
     cv_file.write("Size", imageSize)
     cv_file.write("K1", K1)
@@ -34,13 +45,33 @@ def saveStereoCoefficients(path, imageSize, K1, D1, K2, D2, R, T, E, F, rms, R1=
         cv_file.write("Q", Q)
         cv_file.write("ROIL", roiL)
         cv_file.write("ROIR", roiR)
-        cv_file.write("MAPLX", mapLx)
-        cv_file.write("MAPLY", mapLy)
-        cv_file.write("MAPRX", mapRx)
-        cv_file.write("MAPRY", mapRy)
+        if mapFormat == 'npy':
+            # 大尺寸映射表以二进制保存，YAML中只记录其所在目录（相对路径）
+            mapDir = saveStereoMaps(os.path.splitext(path)[0] + '_maps', [mapLx, mapLy, mapRx, mapRy])
+            cv_file.write("MAPDIR", os.path.relpath(mapDir, os.path.dirname(os.path.abspath(path))))
+        else:
+            cv_file.write("MAPLX", mapLx)
+            cv_file.write("MAPLY", mapLy)
+            cv_file.write("MAPRX", mapRx)
+            cv_file.write("MAPRY", mapRy)
     cv_file.release()
 
 
+def saveStereoMaps(mapDir, maps):
+    """ Save the remap tables as raw .npy files in the given directory. """
+    if not os.path.exists(mapDir):
+        os.makedirs(mapDir)
+    for name, m in zip(MAP_NAMES, maps):
+        np.save(os.path.join(mapDir, name + '.npy'), np.ascontiguousarray(m))
+    return mapDir
+
+
+def loadStereoMaps(mapDir, mmap=True):
+    """ Loads the remap tables saved by saveStereoMaps. With mmap the data is paged in on first use instead of copied. """
+    mode = 'r' if mmap else None
+    return [np.load(os.path.join(mapDir, name + '.npy'), mmap_mode=mode) for name in MAP_NAMES]
+
+
 def loadCoefficients(path):
     """ Loads camera matrix and distortion coefficients. """
     # FILE_STORAGE_READ
@@ -79,10 +110,16 @@ def loadStereoCoefficients(path, rectifid=False):
         Q = cv_file.getNode("Q").mat()
         roiL = cv_file.getNode("ROIL").mat()
         roiR = cv_file.getNode("ROIR").mat()
-        mapLx = cv_file.getNode("MAPLX").mat()
-        mapLy = cv_file.getNode("MAPLY").mat()
-        mapRx = cv_file.getNode("MAPRX").mat()
-        mapRy = cv_file.getNode("MAPRY").mat()
+        mapDir = cv_file.getNode("MAPDIR")
+        if not mapDir.empty():
+            # 二进制映射表，路径相对于YAML文件
+            mapDir = os.path.join(os.path.dirname(os.path.abspath(path)), mapDir.string())
+            mapLx, mapLy, mapRx, mapRy = loadStereoMaps(mapDir)
+        else:
+            mapLx = cv_file.getNode("MAPLX").mat()
+            mapLy = cv_file.getNode("MAPLY").mat()
+            mapRx = cv_file.getNode("MAPRX").mat()
+            mapRy = cv_file.getNode("MAPRY").mat()
         result = [Size, K1, D1, K2, D2, R, T, E, F, rms, R1, R2, P1, P2, Q, roiL, roiR, mapLx, mapLy, mapRx, mapRy]
     else:
         result = [Size, K1, D1, K2, D2, R, T, E, F, rms]
@@ -90,6 +127,31 @@ def loadStereoCoefficients(path, rectifid=False):
     cv_file.release()
     return result
 
+def savePointStore(path, names, objpoints, imgpointsL, imgpointsR, imageShape, rejected=(), squareSize=None, patternSize=None):
+    """ Save detected stereo calibration points (and the pairs they came from) for incremental calibration.
+    squareSize and patternSize are stored so that later runs can check that the points are consistent. """
+    names = np.array(names, dtype=str).reshape(-1, 2)
+    rejected = np.array(rejected, dtype=str).reshape(-1, 2)
+    np.savez(path, names=names, objpoints=np.array(objpoints, np.float32), imgpointsL=np.array(imgpointsL, np.float32),
+             imgpointsR=np.array(imgpointsR, np.float32), imageShape=np.array(imageShape), rejected=rejected,
+             squareSize=np.array([] if squareSize is None else [squareSize], np.float64),
+             patternSize=np.array([] if patternSize is None else patternSize, np.int64))
+
+
+def loadPointStore(path):
+    """ Loads the points saved by savePointStore: [names, objpoints, imgpointsL, imgpointsR, imageShape, rejected, squareSize, patternSize].
+    squareSize and patternSize are None for stores written before they were recorded. """
+    if not os.path.exists(path):
+        return [[], [], [], [], None, [], None, None]
+    with np.load(path) as data:
+        names = [tuple(pair) for pair in data["names"].tolist()]
+        rejected = [tuple(pair) for pair in data["rejected"].tolist()]
+        imageShape = tuple(int(v) for v in data["imageShape"]) if data["imageShape"].size else None
+        squareSize = float(data["squareSize"][0]) if "squareSize" in data and data["squareSize"].size else None
+        patternSize = tuple(int(v) for v in data["patternSize"]) if "patternSize" in data and data["patternSize"].size else None
+        return [names, list(data["objpoints"]), list(data["imgpointsL"]), list(data["imgpointsR"]), imageShape, rejected, squareSize, patternSize]
+
+
 def loadStereoImages(dirL, dirR, imageFormat):
 
     # 图像路径校正. 移除'/'
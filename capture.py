@@ -10,6 +10,9 @@
 
 import cv2
 import os
+import numpy as np
+from cornerDetection import AsyncChessboardDetector, refineCorners
+from calibCoverage import CoverageTracker
 
 
 def makeDir(numCam=1, path='CalibData'):
@@ -47,7 +50,7 @@ def makeDir(numCam=1, path='CalibData'):
         return 0
 
 
-def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001), numCorner1=11, numCorner2=8, idImage=0):
+def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001), numCorner1=11, numCorner2=8, idImage=0, detectScale=0.5, autoCapture=False, maxImages=40):
     '''
     拍摄相机标定图像\n
     参数：\n
@@ -60,6 +63,9 @@ def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TER
     numCorner1：棋盘格行角点数，默认为8\n
     numCorner2：棋盘格行角点数，默认为5\n
     idImage：保存图片的序号
+    detectScale：预览时检测棋盘格的缩放比例，默认为0.5\n
+    autoCapture：自动采集，棋盘格带来新的位置、大小、倾斜或图像区域覆盖时自动保存，覆盖目标达到后自动结束，默认为False\n
+    maxImages：自动采集时最多保存的图片数，默认为40
     '''
     # 调用摄像头
     cap = cv2.VideoCapture(index)                # index -> 摄像头索引
@@ -75,6 +81,12 @@ def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TER
     # cap.set(cv2.CAP_PROP_EXPOSURE, -6)           # 曝光-6
 
 
+    # 后台线程在缩小的图像上检测棋盘格，预览保持相机帧率
+    detector = AsyncChessboardDetector((numCorner1, numCorner2), scale=detectScale)
+    # 自动采集时统计已保存视角的覆盖度
+    tracker = None
+    lastResult = None
+
     if numCam == 2:
         # 定义显示窗口
         cv2.namedWindow("Video2",cv2.WINDOW_NORMAL)
@@ -82,22 +94,18 @@ def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TER
             ret, frame = cap.read()
             frameL = frame[0:720,0:1280]
             frameR = frame[0:720,1280:2560]
+            detector.submit([frameL, frameR])
             camL = frameL.copy()
             camR = frameR.copy()
-            grayL = cv2.cvtColor(camL, cv2.COLOR_BGR2GRAY)
-            grayR = cv2.cvtColor(camR, cv2.COLOR_BGR2GRAY)
-
-            # 寻找棋盘格角点
-            retL, cornersL = cv2.findChessboardCorners(grayL, (numCorner1, numCorner2), None)
-            retR, cornersR = cv2.findChessboardCorners(grayR, (numCorner1, numCorner2), None)
-
-            if retL == True & retR == True:
-                # 获得亚像素角点坐标
-                corners2L = cv2.cornerSubPix(grayL, cornersL, (11, 11), (-1, -1), criteria)
-                corners2R = cv2.cornerSubPix(grayR, cornersR, (11, 11), (-1, -1), criteria)
-                # 绘制并显示角点
-                cv2.drawChessboardCorners(camL, (numCorner1, numCorner2), corners2L, retL)
-                cv2.drawChessboardCorners(camR, (numCorner1, numCorner2), corners2R, retR)
+
+            # 绘制最近一次检测到的角点
+            result = detector.latest()
+            retL = retR = False
+            if result is not None:
+                (retL, cornersL), (retR, cornersR) = result[1]
+                if retL and retR:
+                    cv2.drawChessboardCorners(camL, (numCorner1, numCorner2), cornersL.astype(np.float32), retL)
+                    cv2.drawChessboardCorners(camR, (numCorner1, numCorner2), cornersR.astype(np.float32), retR)
             # 两个框合并
             camLR = cv2.hconcat([camL,camR])
             cv2.imshow('Video2', camLR)
@@ -105,54 +113,93 @@ def getPicture(numCam, index, savePath, width=640, height=480, criteria=(cv2.TER
             # cv2.imshow('VideoR', camR)
 
             key = cv2.waitKey(1)
+            # 按'ESC'退出程序，先于自动采集判断，避免被跳过
+            if key & 0xFF == 27:
+                print('程序已终止！一共保存了{}张图片'.format(idImage))
+                break
+            # 自动采集：每个新的检测结果只判断一次是否带来新的覆盖
+            autoSave = False
+            if autoCapture and retL and retR and result is not lastResult:
+                lastResult = result
+                if tracker is None:
+                    tracker = CoverageTracker((frameL.shape[1], frameL.shape[0]), (numCorner1, numCorner2), maxViews=maxImages)
+                autoSave = tracker.isNovel([cornersL, cornersR])
             # 按‘s’健保存图片
-            if (key & 0xFF == ord('s')):
-                if retL == True & retL == True:
+            if (key & 0xFF == ord('s')) or autoSave:
+                if retL and retR:
+                    # 保存检测所用的图像，并在原分辨率下进行亚像素优化：角点移动较大说明图像模糊，
+                    # 优化后的角点用于覆盖度统计
+                    saveL, saveR = result[0]
+                    cornersL, shiftL = refineCorners(saveL, cornersL, (11, 11), criteria)
+                    cornersR, shiftR = refineCorners(saveR, cornersR, (11, 11), criteria)
+                    if max(shiftL, shiftR) > 2 / detectScale:
+                        print('角点偏移较大，图像可能模糊，建议重新保存')
+                        if autoSave:
+                            continue
                     strIdImage = str(idImage)
-                    cv2.imwrite(savePath + '/left/' + strIdImage + '.png', frameL)
-                    cv2.imwrite(savePath + '/right/' + strIdImage + '.png', frameR)
+                    cv2.imwrite(savePath + '/left/' + strIdImage + '.png', saveL)
+                    cv2.imwrite(savePath + '/right/' + strIdImage + '.png', saveR)
                     print('第{}张图片，保存成功'.format(idImage))
                     idImage = idImage+1
+                    if tracker is not None:
+                        tracker.add([cornersL, cornersR])
+                        print(tracker.report())
+                        if tracker.done():
+                            print('覆盖目标已达到！一共保存了{}张图片'.format(idImage))
+                            break
                 else:
                     print('保存失败！棋盘格不完整，请换个角度重新保存！')
 
-            # 按'ESC'退出程序
-            elif key & 0xFF == 27:
-                print('程序已终止！一共保存了{}张图片'.format(idImage))
-                break
-
     elif numCam == 1:
         cv2.namedWindow("Video1",cv2.WINDOW_NORMAL)
         while True:
             ret, frame = cap.read()
+            detector.submit([frame])
             cam = frame.copy()
-            gray = cv2.cvtColor(cam, cv2.COLOR_BGR2GRAY)
-            # 寻找棋盘格角点
-            rets, corners = cv2.findChessboardCorners(gray, (numCorner1, numCorner2), None)
-
-            if rets == True:
-                # 获得亚像素角点坐标
-                corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-                # 绘制并显示角点
-                cv2.drawChessboardCorners(
-                    cam, (numCorner1, numCorner2), corners2, rets)
+
+            # 绘制最近一次检测到的角点
+            result = detector.latest()
+            rets = False
+            if result is not None:
+                rets, corners = result[1][0]
+                if rets:
+                    cv2.drawChessboardCorners(cam, (numCorner1, numCorner2), corners.astype(np.float32), rets)
             cv2.imshow('Video1', cam)
 
             key = cv2.waitKey(1)
+            # 按'ESC'退出程序，先于自动采集判断，避免被跳过
+            if key & 0xFF == 27:
+                print('程序已终止！一共保存了{}张图片'.format(idImage))
+                break
+            # 自动采集：每个新的检测结果只判断一次是否带来新的覆盖
+            autoSave = False
+            if autoCapture and rets and result is not lastResult:
+                lastResult = result
+                if tracker is None:
+                    tracker = CoverageTracker((frame.shape[1], frame.shape[0]), (numCorner1, numCorner2), maxViews=maxImages)
+                autoSave = tracker.isNovel([corners])
             # 按‘s’健保存图片
-            if (key & 0xFF == ord('s')):
+            if (key & 0xFF == ord('s')) or autoSave:
                 if rets == True:
+                    corners, shift = refineCorners(result[0][0], corners, (11, 11), criteria)
+                    if shift > 2 / detectScale:
+                        print('角点偏移较大，图像可能模糊，建议重新保存')
+                        if autoSave:
+                            continue
                     strIdImage = str(idImage)
-                    cv2.imwrite(savePath + '/' + strIdImage + '.png', frame)
+                    cv2.imwrite(savePath + '/' + strIdImage + '.png', result[0][0])
                     print('第{}张图片，保存成功'.format(idImage))
                     idImage = idImage+1
+                    if tracker is not None:
+                        tracker.add([corners])
+                        print(tracker.report())
+                        if tracker.done():
+                            print('覆盖目标已达到！一共保存了{}张图片'.format(idImage))
+                            break
                 else:
                     print('保存失败！棋盘格不完整，请换个角度重新保存！')
 
-            # 按'ESC'退出程序
-            if key & 0xFF == 27:
-                print('程序已终止！一共保存了{}张图片'.format(idImage))
-                break
+    detector.close()
 
     # 释放摄像头
     cap.release()
@@ -163,6 +210,7 @@ if __name__ == '__main__':
 
     print('Starting the Calibration. Press and maintain the ESC key to exit the script\n')
     print('Push (s) to save the image')
+    # autoCapture=True 时自动保存带来新覆盖的图片，覆盖目标达到后自动结束
     path = makeDir(numCam=2)
     # path = makeDir(numCam=1)
     if path:
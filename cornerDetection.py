@@ -0,0 +1,192 @@
+#  ==================================================================================
+#  代码描述：棋盘格角点检测。多进程并行检测一组图片的角点，结果按输入顺序返回，
+#           供单目标定和双目标定共用。
+#           检测结果可缓存在磁盘上：以图片内容哈希 + 棋盘格尺寸 + 检测参数为键，
+#           粗检测结果和亚像素优化结果分开缓存，不同亚像素窗口共用同一次粗检测
+#  ==================================================================================
+
+import os
+import hashlib
+import threading
+import numpy as np
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+from pipeline import DropOldestQueue
+
+# 终止条件
+criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+class CornerCache(object):
+    '''
+    角点检测结果的磁盘缓存，每个条目为 cacheDir/<key>.npz\n
+    参数：\n
+        cacheDir：缓存目录，默认为'CornerCache'
+    '''
+
+    def __init__(self, cacheDir='CornerCache'):
+        self.cacheDir = cacheDir
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir, exist_ok=True)
+
+    @staticmethod
+    def detectKey(contentHash, patternSize, flags):
+        """ 粗检测（findChessboardCorners）的键 """
+        settings = repr((tuple(patternSize), -1 if flags is None else int(flags)))
+        return hashlib.sha1((contentHash + settings).encode()).hexdigest()
+
+    @staticmethod
+    def refineKey(detectKey, winSize, criteria):
+        """ 亚像素优化（cornerSubPix）的键 """
+        settings = repr((tuple(winSize), tuple(criteria)))
+        return hashlib.sha1((detectKey + settings).encode()).hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.cacheDir, key + '.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save(self, key, **arrays):
+        # 先写临时文件再替换，多个进程同时写入时不会读到不完整的文件
+        path = os.path.join(self.cacheDir, key + '.npz')
+        tmp = os.path.join(self.cacheDir, '{}.{}.tmp.npz'.format(key, os.getpid()))
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+
+def detectCorners(path, patternSize, flags=None, winSize=(11, 11), criteria=criteria, cacheDir=None):
+    '''
+    检测单张图片的棋盘格角点并进行亚像素优化\n
+    参数：\n
+        path：图片路径\n
+        patternSize：棋盘格角点数 (宽, 高)\n
+        flags：cv2.findChessboardCorners的flags\n
+        winSize：cv2.cornerSubPix的搜索窗口\n
+        cacheDir：角点缓存目录，为None时不使用缓存\n
+    返回：(ret, corners, shape)，shape为灰度图的 (高, 宽)，图片读取失败时为None
+    '''
+    if cacheDir is None:
+        img = cv2.imread(path)
+        if img is None:
+            return False, None, None
+        return _detect(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), patternSize, flags, winSize, criteria)
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    cache = CornerCache(cacheDir)
+    detectKey = CornerCache.detectKey(hashlib.sha1(content).hexdigest(), patternSize, flags)
+    refineKey = CornerCache.refineKey(detectKey, winSize, criteria)
+
+    # 命中亚像素结果或未检测到棋盘格时，无需解码图片
+    detected = cache.load(detectKey)
+    if detected is not None and not detected['ret']:
+        return False, None, tuple(int(v) for v in detected['shape'])
+    refined = cache.load(refineKey)
+    if refined is not None:
+        return True, refined['corners'], tuple(int(v) for v in refined['shape'])
+
+    img = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return False, None, None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if detected is None:
+        ret, corners = cv2.findChessboardCorners(img, patternSize, flags)
+        cache.save(detectKey, ret=ret, corners=corners if ret else np.zeros((0, 1, 2), np.float32), shape=img.shape)
+        if not ret:
+            return False, None, img.shape
+    else:
+        corners = detected['corners']
+    corners = cv2.cornerSubPix(img, corners.copy(), winSize, (-1, -1), criteria)
+    cache.save(refineKey, corners=corners, shape=img.shape)
+    return True, corners, img.shape
+
+
+def _detect(gray, patternSize, flags, winSize, criteria):
+    ret, corners = cv2.findChessboardCorners(gray, patternSize, flags)
+    if ret:
+        corners = cv2.cornerSubPix(gray, corners, winSize, (-1, -1), criteria)
+    return ret, corners, gray.shape
+
+
+def _detectCorners(args):
+    return detectCorners(*args)
+
+
+def detectCornersBatch(paths, patternSize, flags=None, winSize=(11, 11), workers=None, cacheDir=None):
+    '''
+    并行检测多张图片的角点\n
+    参数：\n
+        paths：图片路径列表\n
+        workers：进程数，默认为CPU核数，为1时在当前进程中顺序执行\n
+        cacheDir：角点缓存目录，为None时不使用缓存\n
+    返回：与paths顺序一致的 [(ret, corners, shape), ...]
+    '''
+    if cacheDir is not None:
+        CornerCache(cacheDir)
+    tasks = [(path, patternSize, flags, winSize, criteria, cacheDir) for path in paths]
+    if workers == 1 or len(tasks) <= 1:
+        return [_detectCorners(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_detectCorners, tasks, chunksize=max(1, len(tasks) // 64)))
+
+
+class AsyncChessboardDetector(object):
+    '''
+    后台线程中检测棋盘格，用于采集标定图片时的实时预览\n
+    只检测最新提交的一组图像（旧的未处理图像直接丢弃），检测在缩小的图像上进行，
+    并使用CALIB_CB_FAST_CHECK快速排除没有棋盘格的图像\n
+    参数：\n
+        patternSize：棋盘格角点数 (宽, 高)\n
+        scale：检测时的缩放比例，默认为0.5\n
+        flags：cv2.findChessboardCorners的flags
+    '''
+
+    def __init__(self, patternSize, scale=0.5, flags=cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK):
+        self.patternSize = patternSize
+        self.scale = scale
+        self.flags = flags
+        self._queue = DropOldestQueue(1)
+        self._lock = threading.Lock()
+        self._result = None
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, images):
+        """ 提交一组图像（如左右图），只保留最新的一组 """
+        self._queue.put(list(images))
+
+    def latest(self):
+        """ 最近一次检测结果：(images, [(ret, corners), ...])，角点为原分辨率坐标（未亚像素优化），尚无结果时为None """
+        with self._lock:
+            return self._result
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=1.0)
+
+    def _loop(self):
+        while True:
+            images = self._queue.get()
+            if images is None:
+                break
+            results = [self.detect(image) for image in images]
+            with self._lock:
+                self._result = (images, results)
+
+    def detect(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        ret, corners = cv2.findChessboardCorners(small, self.patternSize, self.flags)
+        if ret:
+            corners = corners / self.scale
+        return ret, corners
+
+
+def refineCorners(image, corners, winSize=(11, 11), criteria=criteria):
+    """ 在原分辨率图像上对角点进行亚像素优化，返回 (优化后的角点, 角点平均移动距离) """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    coarse = np.ascontiguousarray(corners, np.float32)
+    refined = cv2.cornerSubPix(gray, coarse.copy(), winSize, (-1, -1), criteria)
+    return refined, float(np.linalg.norm(refined - coarse, axis=-1).mean())
@@ -0,0 +1,159 @@
+#  ==================================================================================
+#  代码描述：利用校正得到的Q矩阵将视差图转换为以米为单位的深度图
+#  ==================================================================================
+
+import numpy as np
+
+# SGBM/BM输出的视差为16位定点数，实际视差 = 输出值 / 16
+DISP_SCALE = 16
+
+
+class DepthConverter(object):
+    '''
+    视差图 -> 深度图（float32，单位：米）\n
+    参数：\n
+        Q：stereoRectify得到的4x4重投影矩阵\n
+        unitScale：标定单位到米的换算系数，棋盘格尺寸以毫米为单位时为0.001\n
+        minDisparity：小于该值的视差视为无效（SGBM的minDisparity），非正视差始终无效，默认为0\n
+        invalid：无效像素的深度值，默认为0
+    '''
+
+    def __init__(self, Q, unitScale=0.001, minDisparity=0, invalid=0.0):
+        Q = np.asarray(Q, np.float64)
+        # Z = f / (Q[3,2] * d + Q[3,3])，其中 f = Q[2,3]，Q[3,2] = -1/Tx
+        self.focal = Q[2, 3]
+        self.a = Q[3, 2]
+        self.b = Q[3, 3]
+        self.unitScale = unitScale
+        self.minDisparity = minDisparity
+        self.invalid = invalid
+        self.lut = self._buildLut()
+        self._index = None   # compute()给定dst时复用的索引缓冲区
+
+    def _buildLut(self):
+        """ 对全部int16视差值预先计算深度，以uint16视图作为索引 """
+        values = np.arange(-32768, 32768, dtype=np.int16)
+        depth = self.disparityToDepth(values.astype(np.float64) / DISP_SCALE).astype(np.float32)
+        lut = np.empty(65536, np.float32)
+        lut[values.view(np.uint16)] = depth
+        return lut
+
+    def disparityToDepth(self, disparity):
+        """ 真实视差（像素，浮点） -> 深度（米） """
+        disparity = np.asarray(disparity, np.float64)
+        w = self.a * disparity + self.b
+        valid = (disparity >= self.minDisparity) & (disparity > 0) & (w > 0)
+        depth = np.full(disparity.shape, self.invalid, np.float64)
+        depth[valid] = self.focal * self.unitScale / w[valid]
+        return depth
+
+    def depthToDisparity(self, depth):
+        """ 深度（米） -> 真实视差（像素） """
+        return (self.focal * self.unitScale / np.asarray(depth, np.float64) - self.b) / self.a
+
+    def compute(self, disp, dst=None):
+        '''
+        将SGBM/WLS输出的int16定点视差图转换为float32深度图\n
+        参数：\n
+            disp：int16视差图（视差*16）\n
+            dst：可选的输出缓冲区，float32，形状与disp相同。给定时索引转换也使用内部缓冲区，
+                 每帧不分配新数组，此时同一个DepthConverter不能在多个线程中同时调用
+        '''
+        disp = np.asarray(disp)
+        if disp.dtype != np.int16:
+            disp = disp.astype(np.int16)
+        index = disp.view(np.uint16)
+        if dst is not None:
+            # np.take会先把索引转换为intp数组，预先转换到复用的缓冲区中
+            if self._index is None or self._index.shape != disp.shape:
+                self._index = np.empty(disp.shape, np.intp)
+            np.copyto(self._index, index)
+            index = self._index
+        # uint16索引不会越界；mode为默认的raise时numpy会先写入临时数组再复制到dst
+        return np.take(self.lut, index, out=dst, mode='clip')
+
+
+def disparityRange(Q, minDistance, maxDistance=None, unitScale=0.001, multiple=16):
+    '''
+    由工作距离范围计算SGBM/BM的视差搜索范围，焦距和基线取自Q矩阵\n
+    参数：\n
+        Q：stereoRectify得到的4x4重投影矩阵\n
+        minDistance：最近工作距离（米），决定最大视差\n
+        maxDistance：最远工作距离（米），决定minDisparity，为None时搜索到无穷远\n
+        unitScale：标定单位到米的换算系数，棋盘格尺寸以毫米为单位时为0.001\n
+        multiple：numDisparities需要是该值的倍数，默认为16\n
+    返回：(minDisparity, numDisparities)，搜索范围 [minDisparity, minDisparity + numDisparities) 覆盖整个工作距离
+    '''
+    Q = np.asarray(Q, np.float64)
+    # d = (f / Z - Q[3,3]) / Q[3,2]，与DepthConverter.depthToDisparity相同
+    focal, a, b = Q[2, 3] * unitScale, Q[3, 2], Q[3, 3]
+    far = -b / a if maxDistance is None else (focal / maxDistance - b) / a
+    near = (focal / minDistance - b) / a
+    minDisparity = max(int(np.floor(far)), 0)
+    numDisparities = int(np.ceil((np.ceil(near) - minDisparity + 1) / float(multiple))) * multiple
+    return minDisparity, max(numDisparities, multiple)
+
+
+def samplePoints(depth, points, radius=1):
+    '''
+    以每个点为中心取(2*radius+1)^2邻域的深度值，一次向量化完成\n
+    参数：\n
+        depth：深度图或视差图\n
+        points：N x 2 数组，每行为 (x, y)\n
+        radius：邻域半径，默认为1（3x3邻域）\n
+    返回：N x (2*radius+1)^2 数组
+    '''
+    points = np.asarray(points, np.int64).reshape(-1, 2)
+    offsets = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+    xs = np.clip(points[:, 0:1] + dx.ravel(), 0, depth.shape[1] - 1)
+    ys = np.clip(points[:, 1:2] + dy.ravel(), 0, depth.shape[0] - 1)
+    return depth[ys, xs]
+
+
+def sampleBoxes(depth, boxes, samples=8):
+    '''
+    在每个矩形框内均匀取 samples x samples 个点的深度值\n
+    参数：\n
+        boxes：N x 4 数组，每行为 (x, y, w, h)\n
+        samples：每个方向的采样数，默认为8\n
+    返回：N x samples^2 数组
+    '''
+    boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+    # 采样点位于将框等分后的各小格中心
+    t = (np.arange(samples) + 0.5) / samples
+    xs = boxes[:, 0:1] + boxes[:, 2:3] * t
+    ys = boxes[:, 1:2] + boxes[:, 3:4] * t
+    xs = np.clip(xs, 0, depth.shape[1] - 1).astype(np.int64)
+    ys = np.clip(ys, 0, depth.shape[0] - 1).astype(np.int64)
+    return depth[ys[:, :, None], xs[:, None, :]].reshape(len(boxes), -1)
+
+
+def robustDistance(values, invalid=0.0, minValid=1):
+    '''
+    每行取有效值的中位数，有效值少于minValid的行返回NaN\n
+    参数：\n
+        values：N x M 数组，每行为一次查询的采样值\n
+        invalid：无效值，默认为0
+    '''
+    values = np.asarray(values, np.float32)
+    valid = np.isfinite(values) & (values != invalid)
+    count = valid.sum(axis=1)
+    # 无效值置为+inf后排序，有效值排在前面，取第 count//2 个（偶数时取中间两个的均值）
+    ordered = np.sort(np.where(valid, values, np.inf), axis=1)
+    rows = np.arange(len(values))
+    lo = ordered[rows, np.maximum(count - 1, 0) // 2]
+    hi = ordered[rows, count // 2]
+    result = (lo + hi) / 2
+    result[count < minValid] = np.nan
+    return result
+
+
+def queryPoints(depth, points, radius=1, invalid=0.0, minValid=1):
+    """ 批量查询点的距离：每个点取邻域内有效深度的中位数，返回长度为N的数组，无有效值时为NaN """
+    return robustDistance(samplePoints(depth, points, radius), invalid, minValid)
+
+
+def queryBoxes(depth, boxes, samples=8, invalid=0.0, minValid=1):
+    """ 批量查询矩形框的距离：每个框取均匀采样点中有效深度的中位数，返回长度为N的数组，无有效值时为NaN """
+    return robustDistance(sampleBoxes(depth, boxes, samples), invalid, minValid)
@@ -0,0 +1,461 @@
+#  ==================================================================================
+#  代码描述：视差计算引擎。左右匹配器 + WLS滤波，左右匹配可在线程池中并行执行
+#           （OpenCV计算期间会释放GIL）；静止场景中可只重新计算发生变化的区域
+#  ==================================================================================
+
+import time
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+
+# SGBM模式名称
+SGBM_MODES = {
+    'sgbm': cv2.STEREO_SGBM_MODE_SGBM,
+    '3way': cv2.STEREO_SGBM_MODE_SGBM_3WAY,
+    'hh4': cv2.STEREO_SGBM_MODE_HH4,
+    'hh': cv2.STEREO_SGBM_MODE_HH,
+}
+
+
+def createSGBM(minDisparity=2, numDisparities=128, blockSize=3, mode=cv2.STEREO_SGBM_MODE_SGBM, channels=3):
+    """ 按main.py中的参数创建StereoSGBM匹配器 """
+    return cv2.StereoSGBM_create(minDisparity=minDisparity,
+                                 numDisparities=numDisparities,
+                                 blockSize=blockSize,
+                                 uniquenessRatio=10,
+                                 speckleWindowSize=100,
+                                 speckleRange=32,
+                                 disp12MaxDiff=12,
+                                 P1=8 * channels * blockSize ** 2,
+                                 P2=32 * channels * blockSize ** 2,
+                                 mode=mode)
+
+
+def createBM(minDisparity=2, numDisparities=128, blockSize=9):
+    """ 创建StereoBM匹配器，后处理参数与createSGBM相同；blockSize为不小于5的奇数 """
+    bm = cv2.StereoBM_create(numDisparities=numDisparities, blockSize=max(5, blockSize | 1))
+    bm.setMinDisparity(minDisparity)
+    bm.setUniquenessRatio(10)
+    bm.setSpeckleWindowSize(100)
+    bm.setSpeckleRange(32)
+    bm.setDisp12MaxDiff(12)
+    return bm
+
+
+# 匹配器后端：StereoBM和四种SGBM模式
+MATCHER_BACKENDS = ['bm'] + list(SGBM_MODES)
+
+
+def createMatcher(backend='sgbm', minDisparity=2, numDisparities=128, blockSize=3, channels=3):
+    """ 按后端名称创建匹配器：bm / sgbm / 3way / hh4 / hh """
+    if backend == 'bm':
+        return createBM(minDisparity, numDisparities, blockSize)
+    if backend not in SGBM_MODES:
+        raise ValueError('未知的匹配器后端: {}，可选: {}'.format(backend, ', '.join(MATCHER_BACKENDS)))
+    return createSGBM(minDisparity, numDisparities, blockSize, SGBM_MODES[backend], channels)
+
+
+def filterMedian(disp, invalid, dst=None):
+    """ 5x5中值滤波去除孤立的错误视差（medianBlur不支持int16，经float32转换） """
+    result = cv2.medianBlur(disp.astype(np.float32), 5).astype(np.int16)
+    if dst is None:
+        return result
+    np.copyto(dst, result)
+    return dst
+
+
+def filterFill(disp, invalid, dst=None):
+    """ 每个无效像素用同一行左侧最近的有效视差填充（遮挡区域通常属于背景），再进行中值滤波 """
+    h, w = disp.shape
+    index = np.where(disp > invalid, np.arange(w, dtype=np.int32)[None, :], 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return filterMedian(np.take_along_axis(disp, index, axis=1), invalid, dst)
+
+
+# 只计算左视差时可选的后处理，比右匹配 + WLS滤波便宜
+POST_FILTERS = {
+    'median': filterMedian,
+    'fill': filterFill,
+}
+
+
+def timed(timer, name, func, *args):
+    """ timer为None时直接调用func，否则通过timer.run(name, func, *args)计时（如benchmark.StageTimer） """
+    if timer is None:
+        return func(*args)
+    return timer.run(name, func, *args)
+
+
+def cloneMatcher(matcher):
+    """ 复制StereoSGBM/StereoBM匹配器的参数，得到可在其他线程中独立使用的新对象 """
+    if isinstance(matcher, cv2.StereoSGBM):
+        return cv2.StereoSGBM_create(minDisparity=matcher.getMinDisparity(),
+                                     numDisparities=matcher.getNumDisparities(),
+                                     blockSize=matcher.getBlockSize(),
+                                     P1=matcher.getP1(),
+                                     P2=matcher.getP2(),
+                                     disp12MaxDiff=matcher.getDisp12MaxDiff(),
+                                     preFilterCap=matcher.getPreFilterCap(),
+                                     uniquenessRatio=matcher.getUniquenessRatio(),
+                                     speckleWindowSize=matcher.getSpeckleWindowSize(),
+                                     speckleRange=matcher.getSpeckleRange(),
+                                     mode=matcher.getMode())
+    if isinstance(matcher, cv2.StereoBM):
+        clone = cv2.StereoBM_create(matcher.getNumDisparities(), matcher.getBlockSize())
+        clone.setMinDisparity(matcher.getMinDisparity())
+        clone.setPreFilterType(matcher.getPreFilterType())
+        clone.setPreFilterSize(matcher.getPreFilterSize())
+        clone.setPreFilterCap(matcher.getPreFilterCap())
+        clone.setTextureThreshold(matcher.getTextureThreshold())
+        clone.setUniquenessRatio(matcher.getUniquenessRatio())
+        clone.setSpeckleWindowSize(matcher.getSpeckleWindowSize())
+        clone.setSpeckleRange(matcher.getSpeckleRange())
+        clone.setDisp12MaxDiff(matcher.getDisp12MaxDiff())
+        return clone
+    raise TypeError('不支持复制的匹配器类型: {}'.format(type(matcher).__name__))
+
+
+class TiledMatcher(object):
+    '''
+    条带分块匹配器：将图像按行切分为若干水平条带，每个条带上下各扩展overlap行后在线程池中独立匹配，
+    最后只取各条带中心部分拼接。每个条带使用独立的匹配器对象\n
+    参数：\n
+        matcher：StereoSGBM/StereoBM匹配器，用于复制参数\n
+        strips：条带数量，默认为4\n
+        overlap：条带上下扩展的行数，默认为 max(blockSize, 32)，需要覆盖匹配窗口和SGBM纵向路径聚合的影响范围\n
+        right：是否作为右匹配器（createRightMatcher）使用，默认为False
+    '''
+
+    def __init__(self, matcher, strips=4, overlap=None, right=False):
+        self.strips = strips
+        self.overlap = max(matcher.getBlockSize(), 32) if overlap is None else overlap
+        self.matchers = []
+        for _ in range(strips):
+            clone = cloneMatcher(matcher)
+            self.matchers.append(cv2.ximgproc.createRightMatcher(clone) if right else clone)
+        self._pool = ThreadPoolExecutor(max_workers=strips)
+
+    def bands(self, height):
+        """ 每个条带的 (输出起始行, 输出结束行, 计算起始行, 计算结束行) """
+        edges = np.linspace(0, height, self.strips + 1).astype(int)
+        return [(y0, y1, max(y0 - self.overlap, 0), min(y1 + self.overlap, height)) for y0, y1 in zip(edges[:-1], edges[1:])]
+
+    def compute(self, imageA, imageB, dst=None):
+        h = imageA.shape[0]
+        if dst is None:
+            dst = np.empty(imageA.shape[:2], np.int16)
+        bands = self.bands(h)
+        futures = [self._pool.submit(m.compute, imageA[c0:c1], imageB[c0:c1]) for m, (_, _, c0, c1) in zip(self.matchers, bands)]
+        for future, (y0, y1, c0, _) in zip(futures, bands):
+            dst[y0:y1] = future.result()[y0 - c0:y1 - c0]
+        return dst
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class PyramidMatcher(object):
+    '''
+    由粗到精的金字塔匹配器：先在缩小的图像上以按比例缩小的视差范围匹配，再将结果放大回原分辨率；
+    refine为True时，在原分辨率下按水平条带、以粗视差附近的窄视差范围重新匹配\n
+    参数：\n
+        matcher：原分辨率下的StereoSGBM/StereoBM匹配器，用于复制参数\n
+        scale：缩放比例，如0.5表示宽高各缩小一半，默认为0.5\n
+        refine：是否在原分辨率下精细匹配，默认为False\n
+        band：精细匹配时在粗视差范围两侧扩展的像素数，默认为4\n
+        strips：精细匹配的条带数量，默认为8\n
+        right：是否作为右匹配器（createRightMatcher）使用，右匹配器不支持refine，默认为False
+    '''
+
+    def __init__(self, matcher, scale=0.5, refine=False, band=4, strips=8, right=False):
+        self.scale = scale
+        self.refine = refine and not right
+        self.band = band
+        self.minDisparity = matcher.getMinDisparity()
+        self.numDisparities = matcher.getNumDisparities()
+
+        coarse = cloneMatcher(matcher)
+        coarse.setMinDisparity(int(np.floor(self.minDisparity * scale)))
+        coarse.setNumDisparities(max(16, int(np.ceil(self.numDisparities * scale / 16)) * 16))
+        self.coarse = cv2.ximgproc.createRightMatcher(coarse) if right else coarse
+        # 无效视差值：(minDisparity - 1) * 16
+        self.coarseInvalid = (self.coarse.getMinDisparity() - 1) * 16
+        fullMin = (1 - self.minDisparity - self.numDisparities) if right else self.minDisparity
+        self.invalid = (fullMin - 1) * 16
+
+        self.tiles = None
+        if self.refine:
+            self.tiles = TiledMatcher(matcher, strips, overlap=max(matcher.getBlockSize(), 8))
+
+    def upsample(self, disp, size):
+        """ 将粗视差放大到原分辨率，视差值同时按比例放大 """
+        up = cv2.resize(disp, size, interpolation=cv2.INTER_NEAREST)
+        invalid = up <= self.coarseInvalid
+        up = (up.astype(np.float32) * (1.0 / self.scale)).astype(np.int16)
+        up[invalid] = self.invalid
+        return up
+
+    def compute(self, imageA, imageB, dst=None):
+        h, w = imageA.shape[:2]
+        small = (max(int(round(w * self.scale)), 1), max(int(round(h * self.scale)), 1))
+        smallA = cv2.resize(imageA, small, interpolation=cv2.INTER_AREA)
+        smallB = cv2.resize(imageB, small, interpolation=cv2.INTER_AREA)
+        disp = self.upsample(self.coarse.compute(smallA, smallB), (w, h))
+        if self.refine:
+            disp = self._refine(imageA, imageB, disp)
+        if dst is None:
+            return disp
+        np.copyto(dst, disp)
+        return dst
+
+    def _refine(self, imageA, imageB, coarse):
+        """ 每个条带只搜索粗视差 [1%, 99%] 分位数两侧各扩展band像素的范围 """
+        full = (self.minDisparity, self.minDisparity + self.numDisparities)
+        valid = coarse > self.invalid
+        result = np.empty_like(coarse)
+        futures = []
+        for m, (y0, y1, c0, c1) in zip(self.tiles.matchers, self.tiles.bands(coarse.shape[0])):
+            values = coarse[y0:y1][valid[y0:y1]]
+            if values.size == 0:
+                result[y0:y1] = self.invalid
+                continue
+            lo, hi = np.percentile(values, [1, 99]) / 16.0
+            dmin = int(np.clip(np.floor(lo - self.band), full[0], full[1] - 16))
+            dmax = int(np.clip(np.ceil(hi + self.band), dmin + 1, full[1]))
+            numD = int(np.ceil((dmax - dmin) / 16.0)) * 16
+            m.setMinDisparity(dmin)
+            m.setNumDisparities(numD)
+            futures.append((self.tiles._pool.submit(m.compute, imageA[c0:c1], imageB[c0:c1]), y0, y1, c0, dmin))
+        for future, y0, y1, c0, dmin in futures:
+            strip = future.result()[y0 - c0:y1 - c0]
+            strip[strip <= (dmin - 1) * 16] = self.invalid
+            result[y0:y1] = strip
+        return result
+
+    def close(self):
+        if self.tiles is not None:
+            self.tiles.close()
+
+
+class DisparityEngine(object):
+    '''
+    视差计算引擎\n
+    参数：\n
+        matcher：左匹配器，如cv2.StereoSGBM_create创建的对象\n
+        useWls：是否使用右匹配器 + WLS滤波，默认为True\n
+        lmbda, sigma：WLS滤波参数\n
+        parallel：是否在线程池中并行执行左右匹配，默认为True\n
+        strips：大于1时使用TiledMatcher按水平条带分块并行匹配，默认为1\n
+        overlap：分块匹配时条带的重叠行数，默认由TiledMatcher决定\n
+        pyramidScale：小于1时使用PyramidMatcher在缩小的图像上匹配，优先于strips，默认为1.0\n
+        refine：金字塔模式下是否在原分辨率下按窄视差范围精细匹配左视差，默认为False\n
+        postFilter：不使用WLS时对左视差的后处理，POST_FILTERS中的名称（median/fill），默认为None\n
+        timer：可选的计时器，给定时左右匹配、WLS滤波和后处理分别计时（sgbmL/sgbmR/wls/postFilter），见timed()
+    '''
+
+    def __init__(self, matcher, useWls=True, lmbda=80000, sigma=1.8, parallel=True, strips=1, overlap=None, pyramidScale=1.0, refine=False, postFilter=None, timer=None):
+        self.useWls = useWls
+        self.timer = timer
+        self.postFilter = POST_FILTERS[postFilter] if postFilter else None
+        # 匹配器输出的无效视差值
+        self.invalid = (matcher.getMinDisparity() - 1) * 16
+        self.parallel = parallel
+        self.strips = strips
+        self.pyramidScale = pyramidScale
+        self.matcherR = None
+        self.wlsFilter = None
+        if useWls:
+            # createDisparityWLSFilter会修改左匹配器的参数（关闭speckle滤波和左右一致性检查），
+            # 必须在TiledMatcher/PyramidMatcher复制匹配器之前创建，分块和金字塔模式才与单次匹配使用相同的参数
+            self.wlsFilter = cv2.ximgproc.createDisparityWLSFilter(matcher_left=matcher)
+            self.wlsFilter.setLambda(lmbda)
+            self.wlsFilter.setSigmaColor(sigma)
+        if pyramidScale < 1.0:
+            self.matcher = PyramidMatcher(matcher, pyramidScale, refine)
+        elif strips > 1:
+            self.matcher = TiledMatcher(matcher, strips, overlap)
+        else:
+            self.matcher = matcher
+        if useWls:
+            if pyramidScale < 1.0:
+                self.matcherR = PyramidMatcher(matcher, pyramidScale, right=True)
+            elif strips > 1:
+                self.matcherR = TiledMatcher(matcher, strips, overlap, right=True)
+            else:
+                self.matcherR = cv2.ximgproc.createRightMatcher(matcher)
+        self._pool = ThreadPoolExecutor(max_workers=2) if parallel else None
+
+    def match(self, grayL, grayR, dstL=None, dstR=None):
+        """ 计算左右视差图 (int16，视差*16)，不使用WLS时右视差为None；dstL/dstR为可选的int16输出缓冲区 """
+        timer = self.timer
+        if not self.useWls:
+            return timed(timer, 'sgbmL', self.matcher.compute, grayL, grayR, dstL), None
+        if self._pool is not None:
+            futureR = self._pool.submit(timed, timer, 'sgbmR', self.matcherR.compute, grayR, grayL, dstR)
+            dispL = timed(timer, 'sgbmL', self.matcher.compute, grayL, grayR, dstL)
+            dispR = futureR.result()
+        else:
+            dispL = timed(timer, 'sgbmL', self.matcher.compute, grayL, grayR, dstL)
+            dispR = timed(timer, 'sgbmR', self.matcherR.compute, grayR, grayL, dstR)
+        return dispL, dispR
+
+    def compute(self, grayL, grayR, dst=None, dstL=None, dstR=None):
+        '''
+        计算视差\n
+        参数：\n
+            dst, dstL, dstR：可选的int16输出缓冲区，分别用于滤波结果和左右视差，尺寸一致时不分配新数组\n
+        返回：(filtered, dispL, dispR)，filtered为WLS滤波后的int16视差图，不使用WLS时为postFilter处理后的左视差，没有postFilter时与dispL相同
+        '''
+        dispL, dispR = self.match(grayL, grayR, dstL, dstR)
+        if not self.useWls:
+            if self.postFilter is not None:
+                return timed(self.timer, 'postFilter', self.postFilter, dispL, self.invalid, dst), dispL, None
+            return dispL, dispL, None
+        # 匹配器输出已经是int16，只有类型不同时才转换，避免每帧复制
+        if dispL.dtype != np.int16:
+            dispL = dispL.astype(np.int16)
+        if dispR.dtype != np.int16:
+            dispR = dispR.astype(np.int16)
+        filtered = timed(self.timer, 'wls', self.wlsFilter.filter, dispL, grayL, dst, dispR)
+        return filtered, dispL, dispR
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for m in [self.matcher, self.matcherR]:
+            if isinstance(m, (TiledMatcher, PyramidMatcher)):
+                m.close()
+
+
+class TemporalReuse(object):
+    '''
+    时间复用的视差计算：场景大部分静止时，只对发生变化的区域重新计算视差\n
+    将校正后的灰度图与上次计算视差时所用的图像逐块比较，找出变化的图块，SGBM（和WLS）只在覆盖这些图块的
+    整行条带上运行（上下各扩展overlap行），其余区域沿用上一帧的视差；每隔refreshInterval帧完整计算一次，
+    避免误差累积\n
+    参数：\n
+        engine：DisparityEngine\n
+        tileSize：图块边长（像素），默认为32\n
+        threshold：灰度差大于该值的像素视为变化，默认为12\n
+        minFraction：图块中变化像素比例大于该值时视为变化，默认为0.02\n
+        refreshInterval：完整计算的间隔帧数，默认为30\n
+        fullRatio：需要重新计算的行比例大于该值时直接完整计算，默认为0.6\n
+        overlap：条带上下扩展的行数，需要覆盖匹配窗口、SGBM纵向路径聚合和WLS滤波的影响范围，默认为32
+    '''
+
+    def __init__(self, engine, tileSize=32, threshold=12, minFraction=0.02, refreshInterval=30, fullRatio=0.6, overlap=32):
+        self.engine = engine
+        self.tileSize = tileSize
+        self.threshold = threshold
+        self.minFraction = minFraction
+        self.refreshInterval = refreshInterval
+        self.fullRatio = fullRatio
+        self.overlap = overlap
+        self._refL = self._refR = None
+        self._filtered = self._dispL = self._dispR = None
+        self._sinceRefresh = 0
+        self.fullTime = None         # 完整计算一帧的耗时（指数平均），用于估计节省的时间
+        self.last = {}               # 最近一帧的统计：changeRatio, rowRatio, full, time, saved
+        self.totalSaved = 0.0
+
+    def reset(self):
+        """ 下一帧强制完整计算 """
+        self._refL = None
+
+    def changedTiles(self, grayL, grayR):
+        """ 与参考图像比较，返回变化图块的布尔数组 (行, 列) """
+        diff = cv2.max(cv2.absdiff(grayL, self._refL), cv2.absdiff(grayR, self._refR))
+        _, mask = cv2.threshold(diff, self.threshold, 1.0, cv2.THRESH_BINARY)
+        h, w = diff.shape
+        grid = (-(-w // self.tileSize), -(-h // self.tileSize))
+        # INTER_AREA缩小到图块网格，得到每个图块中变化像素的比例
+        fraction = cv2.resize(mask.astype(np.float32), grid, interpolation=cv2.INTER_AREA)
+        return fraction > self.minFraction
+
+    def bands(self, tiles, height):
+        """ 覆盖变化图块的行条带 [(输出起始行, 输出结束行, 计算起始行, 计算结束行)]，相邻条带合并 """
+        rows = np.flatnonzero(tiles.any(axis=1))
+        result = []
+        for r in rows:
+            y0, y1 = r * self.tileSize, min((r + 1) * self.tileSize, height)
+            if result and y0 <= result[-1][1]:
+                result[-1][1] = y1
+            else:
+                result.append([y0, y1])
+        return [(y0, y1, max(y0 - self.overlap, 0), min(y1 + self.overlap, height)) for y0, y1 in result]
+
+    def compute(self, grayL, grayR, dst=None, dstL=None, dstR=None):
+        '''
+        与DisparityEngine.compute相同的接口和返回值 (filtered, dispL, dispR)\n
+        返回的数组是内部结果的拷贝（写入dst/dstL/dstR），后续帧不会修改
+        '''
+        t0 = time.perf_counter()
+        engine = self.engine
+        full = (self._refL is None or self._refL.shape != grayL.shape or self._sinceRefresh >= self.refreshInterval)
+        changeRatio = rowRatio = 1.0
+        if not full:
+            tiles = self.changedTiles(grayL, grayR)
+            bands = self.bands(tiles, grayL.shape[0])
+            changeRatio = float(tiles.mean())
+            rowRatio = sum(y1 - y0 for y0, y1, _, _ in bands) / float(grayL.shape[0])
+            full = rowRatio > self.fullRatio
+
+        if full:
+            filtered, dispL, dispR = engine.compute(grayL, grayR)
+            self._filtered = np.array(filtered, np.int16)
+            self._dispL = np.array(dispL, np.int16)
+            self._dispR = np.array(dispR, np.int16) if dispR is not None else None
+            self._refL = grayL.copy()
+            self._refR = grayR.copy()
+            self._sinceRefresh = 0
+            rowRatio = 1.0
+        else:
+            for y0, y1, c0, c1 in bands:
+                a, b = grayL[c0:c1], grayR[c0:c1]
+                filtered, dispL, dispR = engine.compute(a, b)
+                self._filtered[y0:y1] = filtered[y0 - c0:y1 - c0]
+                self._dispL[y0:y1] = dispL[y0 - c0:y1 - c0]
+                if dispR is not None:
+                    self._dispR[y0:y1] = dispR[y0 - c0:y1 - c0]
+                # 参考图像只更新重新计算过的行，缓慢变化也会累积到阈值以上
+                self._refL[y0:y1] = grayL[y0:y1]
+                self._refR[y0:y1] = grayR[y0:y1]
+            self._sinceRefresh += 1
+
+        filtered = _copyInto(self._filtered, dst)
+        dispL = _copyInto(self._dispL, dstL)
+        dispR = _copyInto(self._dispR, dstR) if self._dispR is not None else None
+        if not self.useWls and engine.postFilter is None:
+            filtered = dispL
+
+        elapsed = time.perf_counter() - t0
+        if full:
+            self.fullTime = elapsed if self.fullTime is None else 0.8 * self.fullTime + 0.2 * elapsed
+        saved = max(self.fullTime - elapsed, 0.0) if self.fullTime is not None else 0.0
+        self.totalSaved += saved
+        self.last = {'changeRatio': changeRatio, 'rowRatio': rowRatio, 'full': full, 'time': elapsed, 'saved': saved}
+        return filtered, dispL, dispR
+
+    @property
+    def useWls(self):
+        return self.engine.useWls
+
+    def report(self):
+        last = self.last
+        if not last:
+            return ''
+        return '变化图块 {:.0%} 重算行 {:.0%}{} 耗时 {:.1f}ms 节省 {:.1f}ms (累计 {:.1f}s)'.format(
+            last['changeRatio'], last['rowRatio'], ' 完整计算' if last['full'] else '', last['time'] * 1000,
+            last['saved'] * 1000, self.totalSaved)
+
+    def close(self):
+        self.engine.close()
+
+
+def _copyInto(src, dst):
+    if dst is None or dst.shape != src.shape:
+        return src.copy()
+    np.copyto(dst, src)
+    return dst
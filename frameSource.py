@@ -0,0 +1,302 @@
+#  ==================================================================================
+#  代码描述：双目图像数据源。统一的read()接口返回带时间戳的左右图像对，
+#           支持左右拼接的双目相机、两个独立相机、视频文件、图片目录和合成数据
+#  ==================================================================================
+
+import time
+import numpy as np
+import cv2
+from calibrationStore import loadStereoImages
+
+
+class FrameSource(object):
+    """ 数据源基类，read()返回 (ok, timestamp, left, right)，timestamp单位为秒 """
+
+    def read(self):
+        raise NotImplementedError
+
+    def readInto(self, frame):
+        """ 读入预先分配的采集缓冲区，左右图为其视图；不支持复用缓冲区的数据源直接调用read() """
+        return self.read()
+
+    def release(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            ok, timestamp, left, right = self.read()
+            if not ok:
+                return
+            yield timestamp, left, right
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def splitSideBySide(frame):
+    """ 将左右拼接的图像从中间切分为左右两幅图（视图，不复制） """
+    half = frame.shape[1] // 2
+    return frame[:, :half], frame[:, half:]
+
+
+def requestGray(cap):
+    """ 请求相机输出YUYV原始数据（不转换为BGR），灰度图直接取Y通道；后端不支持时仍输出BGR """
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+
+def toGray(raw, dst=None):
+    '''
+    将相机输出转换为灰度图\n
+        (高, 宽, 2) 的YUYV原始数据：取Y通道\n
+        (高, 宽, 3) 的BGR图像：cvtColor\n
+        (高, 宽) 的灰度图：直接复制\n
+    无法识别的格式（如压缩格式的一维原始数据）返回None
+    '''
+    if raw.ndim == 3 and raw.shape[2] == 2:
+        return cv2.extractChannel(raw, 0, dst)
+    if raw.ndim == 3 and raw.shape[2] == 3:
+        return cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY, dst)
+    if raw.ndim == 2 and raw.shape[0] > 1:
+        if dst is None or dst.shape != raw.shape:
+            return raw.copy()
+        np.copyto(dst, raw)
+        return dst
+    return None
+
+
+class SideBySideCamera(FrameSource):
+    '''
+    左右图像拼接输出的双目相机\n
+    参数：\n
+        index：相机索引\n
+        width, height：拼接后图像的宽和高，默认为2560x720\n
+        gray：为True时请求YUYV格式并输出灰度图，省去BGR转换，默认为False
+    '''
+
+    def __init__(self, index=0, width=2560, height=720, gray=False):
+        self.cap = cv2.VideoCapture(index)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)     # 宽度
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)   # 高度
+        self.gray = gray
+        self._raw = None    # 灰度模式下复用的原始数据缓冲区
+        if gray:
+            requestGray(self.cap)
+
+    def read(self):
+        return self.readInto(None)
+
+    def readInto(self, frame):
+        """ frame为拼接图像大小的uint8缓冲区（灰度模式下为二维），尺寸一致时直接写入，不分配新图像 """
+        if self.gray:
+            ret, self._raw = self.cap.read(self._raw)
+            if ret:
+                gray = toGray(self._raw, frame)
+                if gray is None:
+                    # 后端返回了无法直接使用的原始数据，恢复为BGR输出
+                    self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                    ret, self._raw = self.cap.read()
+                    gray = toGray(self._raw, frame) if ret else None
+                frame = gray
+        else:
+            ret, frame = self.cap.read(frame)
+        timestamp = time.time()
+        if not ret or frame is None:
+            return False, timestamp, None, None
+        left, right = splitSideBySide(frame)
+        return True, timestamp, left, right
+
+    def release(self):
+        self.cap.release()
+
+
+class DualCamera(FrameSource):
+    '''
+    两个独立的相机\n
+    参数：\n
+        indexL, indexR：左右相机索引\n
+        width, height：单个相机图像的宽和高，默认为1280x720\n
+        gray：为True时请求YUYV格式并输出灰度图，默认为False
+    '''
+
+    def __init__(self, indexL=0, indexR=1, width=1280, height=720, gray=False):
+        self.capL = cv2.VideoCapture(indexL)
+        self.capR = cv2.VideoCapture(indexR)
+        self.gray = gray
+        for cap in [self.capL, self.capR]:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if gray:
+                requestGray(cap)
+
+    def read(self):
+        # 先同时grab再retrieve，尽量减小左右相机的曝光时间差
+        okL = self.capL.grab()
+        okR = self.capR.grab()
+        timestamp = time.time()
+        if not (okL and okR):
+            return False, timestamp, None, None
+        _, left = self.capL.retrieve()
+        _, right = self.capR.retrieve()
+        if self.gray:
+            left, right = toGray(left), toGray(right)
+            if left is None or right is None:
+                return False, timestamp, None, None
+        return True, timestamp, left, right
+
+    def release(self):
+        self.capL.release()
+        self.capR.release()
+
+
+class VideoFileSource(FrameSource):
+    '''
+    视频文件\n
+    参数：\n
+        path：左右拼接的视频文件，或左视频文件（同时给定pathR时）\n
+        pathR：右视频文件，默认为None\n
+        loop：播放结束后是否从头开始，默认为False
+    '''
+
+    def __init__(self, path, pathR=None, loop=False):
+        self.capL = cv2.VideoCapture(path)
+        self.capR = cv2.VideoCapture(pathR) if pathR else None
+        self.loop = loop
+        self.fps = self.capL.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def read(self):
+        ok, left, right = self._read()
+        if not ok and self.loop:
+            for cap in [self.capL, self.capR]:
+                if cap is not None:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, left, right = self._read()
+        timestamp = self.capL.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return ok, timestamp, left, right
+
+    def _read(self):
+        ok, frame = self.capL.read()
+        if not ok:
+            return False, None, None
+        if self.capR is None:
+            left, right = splitSideBySide(frame)
+            return True, left, right
+        okR, right = self.capR.read()
+        return okR, frame, right
+
+    def release(self):
+        self.capL.release()
+        if self.capR is not None:
+            self.capR.release()
+
+
+class ImageDirSource(FrameSource):
+    '''
+    左右图片目录，文件按loadStereoImages的规则配对\n
+    参数：\n
+        dirL, dirR：左右图片目录\n
+        imageFormat：图片格式，png/jpg\n
+        fps：用于生成时间戳的帧率，默认为30\n
+        loop：读完后是否从头开始，默认为False
+    '''
+
+    def __init__(self, dirL, dirR, imageFormat='png', fps=30.0, loop=False):
+        self.pairs = list(loadStereoImages(dirL, dirR, imageFormat))
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        self.count = 0
+
+    def read(self):
+        if self.index >= len(self.pairs):
+            if not self.loop or not self.pairs:
+                return False, self.count / self.fps, None, None
+            self.index = 0
+        imageL, imageR = self.pairs[self.index]
+        left = cv2.imread(imageL)
+        right = cv2.imread(imageR)
+        timestamp = self.count / self.fps
+        self.index += 1
+        self.count += 1
+        return left is not None and right is not None, timestamp, left, right
+
+
+def syntheticPair(imageSize, maxDisparity=64, seed=0, shift=0):
+    '''
+    生成带纹理的合成立体图像对（灰度）及其真实视差（左图坐标，像素）\n
+    参数：\n
+        imageSize：(宽, 高)\n
+        maxDisparity：纹理的最大视差，默认为64\n
+        seed：纹理随机种子\n
+        shift：前景区域水平移动的像素数，用于生成运动序列
+    '''
+    w, h = imageSize
+    rng = np.random.RandomState(seed)
+    texture = cv2.GaussianBlur(rng.randint(0, 256, (h, w + maxDisparity)).astype(np.uint8), (3, 3), 0)
+    # 背景视差较小，前方两块矩形区域视差较大
+    disparity = np.full((h, w), maxDisparity // 4, np.int32)
+    x0 = (w // 5 + shift) % w
+    disparity[h // 4:h * 3 // 4, x0:x0 + w // 5] = maxDisparity // 2
+    disparity[h // 3:h * 2 // 3, w * 3 // 5:w * 4 // 5] = maxDisparity * 3 // 4
+    # 左图像素 x 与右图像素 x - d 对应：R(x) = T(x + maxDisparity)，L(x) = T(x + maxDisparity - d)
+    right = texture[:, maxDisparity:]
+    xs = np.arange(w)[None, :] + maxDisparity - disparity
+    left = texture[np.arange(h)[:, None], xs]
+    return np.ascontiguousarray(left), np.ascontiguousarray(right), disparity
+
+
+class SyntheticSource(FrameSource):
+    '''
+    合成双目数据，用于无相机环境（CI、性能测试）\n
+    参数：\n
+        imageSize：单幅图像 (宽, 高)，默认为1280x720\n
+        maxDisparity：最大视差，默认为64\n
+        frames：帧数，0表示无限，默认为0\n
+        motion：每帧前景移动的像素数，默认为4\n
+        fps：用于生成时间戳的帧率，默认为30
+    '''
+
+    def __init__(self, imageSize=(1280, 720), maxDisparity=64, frames=0, motion=4, fps=30.0):
+        self.imageSize = imageSize
+        self.maxDisparity = maxDisparity
+        self.frames = frames
+        self.motion = motion
+        self.fps = fps
+        self.count = 0
+        self.disparity = None   # 最近一帧的真实视差
+
+    def read(self):
+        if self.frames and self.count >= self.frames:
+            return False, self.count / self.fps, None, None
+        grayL, grayR, self.disparity = syntheticPair(self.imageSize, self.maxDisparity, shift=self.count * self.motion)
+        timestamp = self.count / self.fps
+        self.count += 1
+        return True, timestamp, cv2.cvtColor(grayL, cv2.COLOR_GRAY2BGR), cv2.cvtColor(grayR, cv2.COLOR_GRAY2BGR)
+
+
+def createSource(spec, gray=False):
+    '''
+    根据描述字符串创建数据源，gray为True时相机数据源直接输出灰度图（其他数据源仍输出BGR）\n
+        camera:0                 左右拼接的双目相机\n
+        dual:0,2                 两个独立相机\n
+        video:path[,pathR]       视频文件\n
+        dir:dirL,dirR[,png]      图片目录\n
+        synthetic[:W,H[,frames]] 合成数据
+    '''
+    kind, _, arg = spec.partition(':')
+    args = [a for a in arg.split(',') if a] if arg else []
+    if kind == 'camera':
+        return SideBySideCamera(int(args[0]) if args else 0, gray=gray)
+    if kind == 'dual':
+        return DualCamera(int(args[0]), int(args[1]), gray=gray)
+    if kind == 'video':
+        return VideoFileSource(args[0], args[1] if len(args) > 1 else None)
+    if kind == 'dir':
+        return ImageDirSource(args[0], args[1], args[2] if len(args) > 2 else 'png')
+    if kind == 'synthetic':
+        size = (int(args[0]), int(args[1])) if len(args) >= 2 else (1280, 720)
+        return SyntheticSource(size, frames=int(args[2]) if len(args) > 2 else 0)
+    raise ValueError('未知的数据源: ' + spec)
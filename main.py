@@ -1,22 +1,29 @@
 import numpy as np
 import cv2
+import time
+import argparse
 from openpyxl import Workbook # Used for writing data into an Excel file
 from sklearn.preprocessing import normalize
-from calibrationStore import loadStereoCoefficients
+from pipeline import StereoPipeline, BufferPool
+from frameSource import createSource
+from rectifier import StereoRectifier
+from depth import DepthConverter, queryPoints, disparityRange
+from disparity import DisparityEngine, TemporalReuse, createMatcher
+from qualityControl import QualityController, levelDisparities
+from stages import StereoStages, makeBuffers
+from pointCloud import PointCloudBuilder, PointCloudWriter, CLOUD_FORMATS
 
 # Filtering
 kernel= np.ones((3,3),np.uint8)
 
 def coords_mouse_disp(event,x,y,flags,param):
     if event == cv2.EVENT_LBUTTONDBLCLK:
-        #print x,y,disp[y,x],filteredImg[y,x]
-        average=0
-        for u in range (-1,2):
-            for v in range (-1,2):
-                average += disp[y+u,x+v]
-        average=average/9
-        Distance= -593.97*average**(3) + 1506.8*average**(2) - 1373.1*average + 522.06
-        Distance= np.around(Distance*0.01,decimals=2)
+        # 结果窗口上半部分为视差图，与深度图坐标一致
+        if depth is None or y >= depth.shape[0]:
+            return
+        # 取3x3邻域内有效深度的中位数，批量查询可直接传入多个点或矩形框
+        Distance= queryPoints(depth, [(x, y)], radius=1)[0]
+        Distance= np.around(Distance,decimals=2)
         print('Distance: '+ str(Distance)+' m')
         
 # This section has to be uncommented if you want to take mesurements and store them in the excel
@@ -131,125 +138,154 @@ ws=wb.active
 #***** Parameters for the StereoVision *****
 #*******************************************
 
-# Create StereoSGBM and prepare all parameters
+# 映射表由标定参数按需计算并缓存在./RectifyCache中，加载时一次性转换为定点格式CV_16SC2，remap速度更快
+# 使用stereoRectify.py生成的校正文件时：rectifier = StereoRectifier.fromFile("./RectifyStereoCalibParam.yml", cv2.CV_16SC2)
+rectifier = StereoRectifier.fromCalibration("./stereoCalibParam.yml", mapType=cv2.CV_16SC2)
+
+# Create the matcher and prepare all parameters
+# 匹配器后端：bm (StereoBM，最快，blockSize至少为5，纹理弱的区域空洞较多) / sgbm / 3way / hh4 / hh（见disparity.SGBM_MODES）
+matcher_backend = 'sgbm'
 window_size = 3
 min_disp = 2
 num_disp = 130-min_disp
-stereo = cv2.StereoSGBM_create(minDisparity = min_disp,
-    numDisparities = num_disp,
-    blockSize = window_size,
-    uniquenessRatio = 10,
-    speckleWindowSize = 100,
-    speckleRange = 32,
-    disp12MaxDiff = 12,
-    P1 = 8*3*window_size**2,
-    P2 = 32*3*window_size**2)
-
-# Used for the filtered image
-stereoR=cv2.ximgproc.createRightMatcher(stereo) # Create another stereo for right this time
+# 工作距离范围（米），如 (0.5, 3.0)：给定时由Q矩阵中的焦距和基线计算min_disp和num_disp，
+# 匹配耗时与视差范围成正比，只搜索需要的范围；为None时使用上面的固定值。最远距离为None时搜索到无穷远
+working_distance = None
+if working_distance is not None:
+    min_disp, num_disp = disparityRange(rectifier.Q, working_distance[0], working_distance[1], unitScale=0.001)
+    print('工作距离 {} - {} m，视差搜索范围 [{}, {})'.format(working_distance[0], working_distance[1], min_disp, min_disp + num_disp))
+stereo = createMatcher(matcher_backend, min_disp, num_disp, window_size)
 
 # WLS FILTER Parameters
 lmbda = 80000
 sigma = 1.8
 visual_multiplier = 1.0
+# 后处理：wls 同时计算右视差并进行WLS滤波；none/median/fill 只计算左视差，省去右匹配，
+# median为5x5中值滤波，fill先用同一行左侧的有效视差填充空洞再中值滤波
+post_filter = 'wls'
+
+# 右匹配器和WLS滤波器由引擎创建，左右匹配在线程池中并行执行
+parallel_match = True
+# 大于1时按水平条带分块并行计算SGBM，适合多核机器上的大分辨率图像
+match_strips = 1
+# 小于1时先在缩小的图像上匹配再放大，pyramid_refine为True时在原分辨率下按窄视差范围精细匹配
+pyramid_scale = 1.0
+pyramid_refine = False
+engine = DisparityEngine(stereo, useWls=post_filter == 'wls', lmbda=lmbda, sigma=sigma, parallel=parallel_match, strips=match_strips,
+                         pyramidScale=pyramid_scale, refine=pyramid_refine, postFilter=None if post_filter in ('wls', 'none') else post_filter)
+# 静止场景中只重新计算发生变化的图块所在的行条带，其余区域沿用上一帧的视差，每temporal_refresh帧完整计算一次
+temporal_reuse = False
+temporal_refresh = 30
+temporal = TemporalReuse(engine, refreshInterval=temporal_refresh) if temporal_reuse else None
+
+# 自适应质量：给定目标帧率和/或延迟预算（秒）时，根据实测的阶段耗时逐级调整匹配尺度、视差范围、SGBM模式和WLS开关，
+# 每次调整都会输出日志；启用时使用控制器按上面的匹配器配置为每个等级创建的引擎，不使用上面的engine和temporal
+adaptive_quality = False
+target_fps = 15
+latency_budget = None
+
+def buildEngine(level):
+    # 每个等级都基于上面的配置：mode为None的等级使用matcher_backend，bm没有SGBM模式，所有等级都使用bm；
+    # 只有post_filter为wls时等级才可能使用WLS，关闭WLS的等级使用配置的左视差后处理；匹配尺度在pyramid_scale的基础上缩小
+    backend = matcher_backend if level['mode'] is None or matcher_backend == 'bm' else level['mode']
+    matcher = createMatcher(backend, min_disp, levelDisparities(level, num_disp), window_size)
+    useWls = level['wls'] and post_filter == 'wls'
+    return DisparityEngine(matcher, useWls=useWls, lmbda=lmbda, sigma=sigma, parallel=parallel_match, strips=match_strips,
+                           pyramidScale=pyramid_scale * level['scale'], refine=pyramid_refine,
+                           postFilter=None if post_filter in ('wls', 'none') else post_filter)
+
+quality = None
+if adaptive_quality:
+    quality = QualityController(buildEngine, targetFps=target_fps, latencyBudget=latency_budget)
+    temporal = None
+
+# gray_first为True时先转灰度再只校正单通道图像；remap_color为True时另外校正彩色左图（packet.rectL，用于点云着色等）
+# gray_camera为True时请求相机输出YUYV并直接使用Y通道作为灰度图，结果窗口中的原图也显示为灰度
+gray_first = True
+remap_color = False
+gray_camera = False
+
+# 利用Q矩阵计算深度，标定时棋盘格尺寸单位为毫米
+depthConverter = DepthConverter(rectifier.Q, unitScale=0.001, minDisparity=min_disp)
 
-wls_filter = cv2.ximgproc.createDisparityWLSFilter(matcher_left=stereo)
-wls_filter.setLambda(lmbda)
-wls_filter.setSigmaColor(sigma)
-
-_, _, _, _, _, _, _, _, _, _, _, _, _, _, _, _, _, mapLx, mapLy,mapRx, mapRy = loadStereoCoefficients("./RectifyStereoCalibParam.yml", True)
 #*************************************
 #***** Starting the StereoVision *****
 #*************************************
 
-# Call the two cameras
-cap = cv2.VideoCapture(0)   # Wenn 0 then Right Cam and wenn 2 Left Cam
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 2560)     # 宽度
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)   # 高度
-# CamL= cv2.VideoCapture(2)
-
-while True:
-
-    ret, frame = cap.read()
-    # cv2.imshow("show",frame)
-    # cv2.waitKey(0)
-    frameL = frame[0:720,0:1280]
-    frameR = frame[0:720,1280:2560]
-    frameLR = cv2.hconcat([frameL,frameR])
-    camL = frameL.copy()
-    camR = frameR.copy()
-    # Start Reading Camera images
-    # retR, frameR= CamR.read()
-    # retL, frameL= CamL.read()
-
-    # Rectify the images on rotation and alignement
-    Left_nice= cv2.remap(frameL,mapLx,mapLy, interpolation = cv2.INTER_LINEAR)  # Rectify the image using the kalibration parameters founds during the initialisation
-    Right_nice= cv2.remap(frameR,mapRx,mapRy, interpolation = cv2.INTER_LINEAR)
-
-##    # Draw Red lines
-##    for line in range(0, int(Right_nice.shape[0]/20)): # Draw the Lines on the images Then numer of line is defines by the image Size/20
-##        Left_nice[line*20,:]= (0,0,255)
-##        Right_nice[line*20,:]= (0,0,255)
-##
-##    for line in range(0, int(frameR.shape[0]/20)): # Draw the Lines on the images Then numer of line is defines by the image Size/20
-##        frameL[line*20,:]= (0,255,0)
-##        frameR[line*20,:]= (0,255,0)    
-        
-    # Show the Undistorted images
-    #cv2.imshow('Both Images', np.hstack([Left_nice, Right_nice]))
-    #cv2.imshow('Normal', np.hstack([frameL, frameR]))
-
-    # Convert from color(BGR) to gray
-    grayR= cv2.cvtColor(Right_nice,cv2.COLOR_BGR2GRAY)
-    grayL= cv2.cvtColor(Left_nice,cv2.COLOR_BGR2GRAY)
-
-    # Compute the 2 images for the Depth_image
-    disp= stereo.compute(grayL,grayR)#.astype(np.float32)/ 16
-    dispL= disp
-    dispR= stereoR.compute(grayR,grayL)
-    dispL= np.int16(dispL)
-    dispR= np.int16(dispR)
-
-    # Using the WLS filter
-    filteredImg= wls_filter.filter(dispL,grayL,None,dispR)
-    filteredImg = cv2.normalize(src=filteredImg, dst=filteredImg, beta=0, alpha=255, norm_type=cv2.NORM_MINMAX);
-    filteredImg = np.uint8(filteredImg)
-    #cv2.imshow('Disparity Map', filteredImg)
-    disp= ((disp.astype(np.float32)/ 16)-min_disp)/num_disp # Calculation allowing us to have 0 for the most distant object able to detect
-
-##    # Resize the image for faster executions
-##    dispR= cv2.resize(disp,None,fx=0.7, fy=0.7, interpolation = cv2.INTER_AREA)
-
-    # Filtering the Results with a closing filter
-    closing= cv2.morphologyEx(disp,cv2.MORPH_CLOSE, kernel) # Apply an morphological filter for closing little "black" holes in the picture(Remove noise) 
-
-    # Colors map
-    dispc= (closing-closing.min())*255
-    dispC= dispc.astype(np.uint8)                                   # Convert the type of the matrix from float32 to uint8, this way you can show the results with the function cv2.imshow()
-    disp_Color= cv2.applyColorMap(dispC,cv2.COLORMAP_HSV)         # Change the Color of the Picture into an Ocean Color_Map
-    filt_Color= cv2.applyColorMap(filteredImg,cv2.COLORMAP_HSV) 
-
-    # Show the result for the Depth_image
-    #cv2.imshow('Disparity', disp)
-    #cv2.imshow('Closing',closing)
-    #cv2.imshow('Color Depth',disp_Color)
-    # cv2.imshow('Filtered Color Depth',filt_Color)
-    colorFilt = cv2.vconcat([filt_Color, frameL])
-    cv2.imshow("result", colorFilt)
-
-    # Mouse click
-    # cv2.setMouseCallback("Filtered Color Depth",coords_mouse_disp,filt_Color)
-    cv2.setMouseCallback("result",coords_mouse_disp,colorFilt)
-    
+# 数据源：camera:0 左右拼接的双目相机，dual:0,2 两个独立相机，video:path 视频文件，
+# dir:left,right 图片目录，synthetic 合成数据
+parser = argparse.ArgumentParser(description='Stereo measurement')
+parser.add_argument('--source', type=str, required=False, default='camera:0', help='frame source, camera:0 / dual:0,2 / video:path / dir:dirL,dirR / synthetic')
+parser.add_argument('--pointCloud', type=str, required=False, default='', help='output folder of point clouds, no point cloud is generated when empty')
+parser.add_argument('--cloudFormat', type=str, required=False, default='ply', choices=list(CLOUD_FORMATS), help='binary PLY per batch, or raw float32 stream')
+args = parser.parse_args()
+
+# 点云阶段：每隔point_cloud_stride个像素取一个点，point_cloud_voxel大于0时再按体素（米）降采样，
+# 每point_cloud_batch帧写出一次；需要颜色时同时校正彩色左图
+point_cloud_stride = 4
+point_cloud_voxel = 0.0
+point_cloud_batch = 1
+point_cloud_color = True
+cloudBuilder = cloudWriter = None
+if args.pointCloud:
+    remap_color = remap_color or point_cloud_color
+    cloudBuilder = PointCloudBuilder(rectifier.Q, unitScale=0.001, stride=point_cloud_stride, voxelSize=point_cloud_voxel, minDisparity=min_disp)
+    cloudWriter = PointCloudWriter(args.pointCloud, args.cloudFormat, point_cloud_batch)
+
+# 校正、匹配、后处理（和点云）阶段，与benchmark.py stages测试的是同一份代码
+stages = StereoStages(rectifier, temporal if temporal is not None else engine, depthConverter, min_disp, num_disp,
+                      grayFirst=gray_first, remapColor=remap_color, quality=quality,
+                      cloudBuilder=cloudBuilder, cloudWriter=cloudWriter, cloudColor=point_cloud_color, kernel=kernel)
+
+source = createSource(args.source, gray=gray_camera and gray_first)
+
+# 采集、校正、匹配、后处理分别在独立线程中运行，队列满时丢弃最旧的帧
+# preallocate_buffers为True时每帧的中间结果写入按分辨率预分配、循环复用的缓冲区
+preallocate_buffers = True
+pipeline = StereoPipeline(source, stages.stages(),
+                          buffers=BufferPool(makeBuffers) if preallocate_buffers else None)
+pipeline.start()
+depth = None
+lastReport = time.perf_counter()
+
+while pipeline.running():
+
+    packet = pipeline.get()
+    if packet is not None:
+        depth = packet.depth
+        if quality is not None:
+            quality.observe(packet.stageTimes, time.perf_counter() - packet.timestamp, packet.qualityLevel)
+
+        # Show the result for the Depth_image
+        #cv2.imshow('Disparity', disp)
+        #cv2.imshow('Color Depth',packet.disp_Color)
+        cv2.imshow("result", packet.colorFilt)
+
+        # Mouse click
+        cv2.setMouseCallback("result",coords_mouse_disp,packet.colorFilt)
+
+    # 每秒输出一次延迟和吞吐量
+    if time.perf_counter() - lastReport > 1.0:
+        print(pipeline.report())
+        if temporal is not None:
+            print(temporal.report())
+        lastReport = time.perf_counter()
+
     # End the Programme
     if cv2.waitKey(1) & 0xFF == 27:
         break
-    
+
+pipeline.stop()
+engine.close()
+if quality is not None:
+    quality.close()
+if cloudWriter is not None:
+    cloudWriter.close()
+print(pipeline.report())
+
 # Save excel
 ##wb.save("data4.xlsx")
 
 # Release the Cameras
-cap.release()
-# CamL.release()
+source.release()
 cv2.destroyAllWindows()
-
@@ -3,13 +3,14 @@ import cv2
 import glob
 import argparse
 from calibrationStore import saveCoefficients
+from cornerDetection import detectCornersBatch
 
 # 终止条件
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
 
-def monoCalib(dirPath, prefix, imageFormat, saveFile, squareSize, width=8, height=5):
-    """ 单目标定函数 """
+def monoCalib(dirPath, prefix, imageFormat, saveFile, squareSize, width=8, height=5, workers=None, flags=None, cacheDir=None):
+    """ 单目标定函数，flags为findChessboardCorners的参数，cacheDir为角点缓存目录 """
     # 生成真实角点相对坐标 (0,0,0), (1,0,0), (2,0,0) ....,(8,6,0)
     objp = np.zeros((height*width, 3), np.float32)
     objp[:, :2] = np.mgrid[0:width, 0:height].T.reshape(-1, 2)
@@ -26,27 +27,19 @@ def monoCalib(dirPath, prefix, imageFormat, saveFile, squareSize, width=8, heigh
 
     # 获得图片
     images = glob.glob(dirPath+'/' + prefix + '*.' + imageFormat)
+    images.sort()
     # print(images)
 
-    # 迭代遍历所有图像，将每张图像角点的真实坐标和图像坐标添加到数组中
-    for name in images:
-        img = cv2.imread(name)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # 寻找棋盘格角点
-        ret, corners = cv2.findChessboardCorners(gray, (width, height), None)
-
+    # 多进程并行检测所有图像的角点，将每张图像角点的真实坐标和图像坐标添加到数组中
+    for name, (ret, corners2, shape) in zip(images, detectCornersBatch(images, (width, height), flags, (11, 11), workers, cacheDir)):
         if ret:
             objpoints.append(objp)
-
-            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
             imgpoints.append(corners2)
+            imageShape = shape
+        else:
+            print("未检测到棋盘格: ", name)
 
-            # 绘制并显示棋盘格角点
-            img = cv2.drawChessboardCorners(img, (width, height), corners2, ret)
-            # cv2.imshow(img)
-
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, imageShape[::-1], None, None)
     
     saveCoefficients(saveFile, mtx, dist, ret)
 
@@ -65,8 +58,10 @@ if __name__ == '__main__':
     parser.add_argument('--width', type=int, required=False, default=11, help='chessboard width size, default is 11')
     parser.add_argument('--height', type=int, required=False, default=8, help='chessboard height size, default is 8')
     parser.add_argument('--saveFile', type=str, required=False, default='monoCalibParam.yml', help='YML file to save calibration matrices')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='number of corner detection processes, default is the CPU count')
+    parser.add_argument('--cornerCache', type=str, required=False, default='CornerCache', help='corner detection cache directory, empty to disable')
 
     args = parser.parse_args()
 
     # 调用标定函数. RMS是误差, 误差小于0.2为佳
-    ret, mtx, dist, rvecs, tvecs = monoCalib(args.imageDir, args.prefix, args.imageFormat, args.saveFile,args.squareSize, args.width, args.height)
+    ret, mtx, dist, rvecs, tvecs = monoCalib(args.imageDir, args.prefix, args.imageFormat, args.saveFile,args.squareSize, args.width, args.height, args.workers, cacheDir=args.cornerCache or None)
@@ -0,0 +1,284 @@
+#  ==================================================================================
+#  代码描述：双目测距流水线。采集 -> 校正 -> 匹配 -> 后处理 各阶段运行在独立线程中，
+#           阶段之间使用有界队列连接，队列满时丢弃最旧的帧，保证输出始终来自最新帧。
+#           可选的BufferPool为每帧提供按分辨率预分配、循环复用的中间结果缓冲区
+#  ==================================================================================
+
+import threading
+import queue
+import time
+import traceback
+from collections import deque
+
+
+class FramePacket(object):
+    """ 在流水线各阶段之间传递的一帧数据 """
+
+    def __init__(self, index, timestamp, left, right, sourceTime=None):
+        self.index = index            # 帧序号
+        self.timestamp = timestamp    # 采集时刻 (time.perf_counter)
+        self.sourceTime = sourceTime  # 数据源给出的时间戳
+        self.left = left
+        self.right = right
+        self.stageTimes = {}          # 各阶段耗时，单位秒
+        self.buffers = {}             # 本帧使用的预分配缓冲区，未使用BufferPool时为空
+        self._pool = None
+        self._key = None
+
+    def release(self):
+        """ 将本帧的缓冲区归还给BufferPool，可重复调用 """
+        if self._pool is not None:
+            self._pool.release(self._key, self.buffers)
+            self._pool = None
+            self.buffers = {}
+
+
+class DropOldestQueue(object):
+    """ 有界队列，队列满时丢弃最旧的元素（并调用onDrop）；dropOldest为False时阻塞等待 """
+
+    def __init__(self, maxsize=1, dropOldest=True, onDrop=None):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropOldest = dropOldest
+        self.onDrop = onDrop
+        self.dropped = 0
+
+    def put(self, item):
+        if not self.dropOldest:
+            self._queue.put(item)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    old = self._queue.get_nowait()
+                    self.dropped += 1
+                    if self.onDrop is not None:
+                        self.onDrop(old)
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def clear(self):
+        """ 取出并返回队列中剩余的全部元素 """
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+
+class BufferPool(object):
+    '''
+    按分辨率复用的缓冲区组。每组缓冲区供一帧在流水线中使用，帧处理完或被丢弃后归还，
+    同时在流水线中的帧数有上限，因此预热几帧后不再分配新的缓冲区\n
+    参数：\n
+        factory：factory(shape) 返回一组缓冲区 {name: ndarray}，shape为单幅输入图像的形状
+    '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._free = {}
+        self.allocated = 0    # 已创建的缓冲区组数
+
+    def acquire(self, shape):
+        with self._lock:
+            free = self._free.setdefault(shape, [])
+            if free:
+                return free.pop()
+            self.allocated += 1
+        return self.factory(shape)
+
+    def release(self, shape, buffers):
+        with self._lock:
+            self._free.setdefault(shape, []).append(buffers)
+
+
+class PipelineStats(object):
+    """ 统计每帧的端到端延迟、各阶段耗时和吞吐量 """
+
+    def __init__(self, window=100):
+        self._lock = threading.Lock()
+        self._latency = deque(maxlen=window)
+        self._doneTimes = deque(maxlen=window)
+        self._stageTimes = {}
+        self.window = window
+        self.frames = 0
+
+    def record(self, packet):
+        now = time.perf_counter()
+        with self._lock:
+            self.frames += 1
+            self._latency.append(now - packet.timestamp)
+            self._doneTimes.append(now)
+            for name, t in packet.stageTimes.items():
+                self._stageTimes.setdefault(name, deque(maxlen=self.window)).append(t)
+
+    def fps(self):
+        with self._lock:
+            if len(self._doneTimes) < 2:
+                return 0.0
+            span = self._doneTimes[-1] - self._doneTimes[0]
+            return (len(self._doneTimes) - 1) / span if span > 0 else 0.0
+
+    def latency(self):
+        """ 最近窗口内的平均端到端延迟，单位秒 """
+        with self._lock:
+            if not self._latency:
+                return 0.0
+            return sum(self._latency) / len(self._latency)
+
+    def stageLatency(self):
+        """ 最近窗口内各阶段的平均耗时，单位秒 """
+        with self._lock:
+            return {name: sum(t) / len(t) for name, t in self._stageTimes.items() if t}
+
+    def report(self, dropped=None):
+        stages = ' '.join('{}={:.1f}ms'.format(name, t * 1000) for name, t in self.stageLatency().items())
+        text = '帧数: {} FPS: {:.1f} 延迟: {:.1f}ms [{}]'.format(self.frames, self.fps(), self.latency() * 1000, stages)
+        if dropped:
+            text += ' 丢帧: ' + ' '.join('{}={}'.format(name, n) for name, n in dropped.items())
+        return text
+
+
+class StereoPipeline(object):
+    '''
+    多线程分阶段流水线\n
+    参数：\n
+        source：FrameSource数据源，或返回(left, right)的采集函数（返回None表示数据源结束）\n
+        stages：[(name, func), ...]，func接收FramePacket并返回FramePacket，返回None表示丢弃该帧\n
+        queueSize：阶段之间的队列长度，默认为1\n
+        dropOldest：队列满时是否丢弃最旧的帧，处理录制数据需要逐帧处理时设为False，默认为True\n
+        buffers：BufferPool，给定时每帧从中取得预分配的缓冲区（packet.buffers），帧被丢弃或
+                 下一次get()返回新结果时归还；缓冲区中的'frame'作为相机采集缓冲区（FrameSource.readInto）
+    '''
+
+    def __init__(self, source, stages, queueSize=1, dropOldest=True, buffers=None):
+        self.source = source
+        self.stages = list(stages)
+        self.stats = PipelineStats()
+        self.buffers = buffers
+        self._queues = [DropOldestQueue(queueSize, dropOldest, self._release) for _ in range(len(self.stages) + 1)]
+        self._stop = threading.Event()
+        self._threads = []
+        self._count = 0
+        self._shape = None     # 最近一帧单幅图像的形状，作为缓冲区组的键
+        self._current = None   # 最近一次get()返回的帧
+        self.error = None      # 出错的阶段 (name, exception)，出错后流水线停止
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._captureLoop, name='capture', daemon=True)]
+        for i, (name, func) in enumerate(self.stages):
+            self._threads.append(threading.Thread(target=self._stageLoop, args=(name, func, self._queues[i], self._queues[i + 1]), name=name, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """ 停止并等待所有线程结束，返回后可以安全地释放各阶段使用的资源（如视差引擎） """
+        self._stop.set()
+        for thread in self._threads:
+            # dropOldest为False时线程可能阻塞在已满的队列上，清空队列使其退出
+            while thread.is_alive():
+                for q in self._queues:
+                    for packet in q.clear():
+                        self._release(packet)
+                thread.join(timeout=0.1)
+        self._threads = []
+
+    def running(self):
+        return not self._stop.is_set()
+
+    def get(self, timeout=0.1):
+        """ 取出最新的处理结果，超时返回None """
+        try:
+            packet = self._queues[-1].get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if packet is None:
+            # 数据源结束
+            self._stop.set()
+            return None
+        self.stats.record(packet)
+        # 上一次返回的帧不再使用，归还其缓冲区
+        self._release(self._current)
+        self._current = packet
+        return packet
+
+    def dropped(self):
+        names = ['capture'] + [name for name, _ in self.stages]
+        return {name: q.dropped for name, q in zip(names, self._queues)}
+
+    def report(self):
+        return self.stats.report(self.dropped())
+
+    @staticmethod
+    def _release(packet):
+        if packet is not None:
+            packet.release()
+
+    def _grab(self, buffer=None):
+        """ 返回 (left, right, sourceTime)，数据源结束时返回None """
+        if hasattr(self.source, 'read'):
+            if buffer is not None and hasattr(self.source, 'readInto'):
+                ok, sourceTime, left, right = self.source.readInto(buffer)
+            else:
+                ok, sourceTime, left, right = self.source.read()
+            return (left, right, sourceTime) if ok else None
+        pair = self.source()
+        return None if pair is None else (pair[0], pair[1], None)
+
+    def _captureLoop(self):
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            # 第一帧确定分辨率之后，每帧从缓冲池中取得一组缓冲区
+            buffers = None
+            if self.buffers is not None and self._shape is not None:
+                buffers = self.buffers.acquire(self._shape)
+            frame = self._grab(buffers.get('frame') if buffers is not None else None)
+            if frame is None:
+                if buffers is not None:
+                    self.buffers.release(self._shape, buffers)
+                self._queues[0].put(None)
+                break
+            packet = FramePacket(self._count, t0, frame[0], frame[1], frame[2])
+            if buffers is not None:
+                packet.buffers, packet._pool, packet._key = buffers, self.buffers, self._shape
+            self._shape = frame[0].shape
+            packet.stageTimes['capture'] = time.perf_counter() - t0
+            self._count += 1
+            self._queues[0].put(packet)
+
+    def _stageLoop(self, name, func, inQueue, outQueue):
+        while not self._stop.is_set():
+            try:
+                packet = inQueue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if packet is None:
+                outQueue.put(None)
+                break
+            t0 = time.perf_counter()
+            try:
+                result = func(packet)
+            except Exception as e:
+                # 阶段出错时停止整个流水线，否则主循环会一直等待结果
+                print('流水线阶段 {} 出错，流水线停止'.format(name))
+                traceback.print_exc()
+                self.error = (name, e)
+                packet.release()
+                self._stop.set()
+                outQueue.put(None)
+                break
+            if result is None:
+                packet.release()
+                continue
+            packet = result
+            packet.stageTimes[name] = time.perf_counter() - t0
+            outQueue.put(packet)
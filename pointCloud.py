@@ -0,0 +1,169 @@
+#  ==================================================================================
+#  代码描述：由视差图生成点云。cv2.reprojectImageTo3D重投影，去除无效视差，
+#           按步长或体素网格降采样，以二进制PLY或原始float32格式逐帧/分批写出。
+#           全部操作都在numpy数组上完成，不构造点的Python列表
+#  ==================================================================================
+
+import os
+import numpy as np
+import cv2
+from depth import DISP_SCALE
+
+# 点云输出格式对应的扩展名
+CLOUD_FORMATS = {
+    'ply': '.ply',    # 二进制PLY (binary_little_endian)，每批一个文件
+    'raw': '.f32',    # 原始数据流，所有帧追加到同一个文件
+}
+
+
+class PointCloudBuilder(object):
+    '''
+    视差图 -> 点云（float32，单位：米）\n
+    参数：\n
+        Q：stereoRectify得到的4x4重投影矩阵\n
+        unitScale：标定单位到米的换算系数，棋盘格尺寸以毫米为单位时为0.001\n
+        stride：每隔stride个像素取一个点，默认为1\n
+        voxelSize：体素边长（米），大于0时每个体素只保留一个点，默认为0\n
+        minDisparity：小于该值的视差视为无效，非正视差始终无效，默认为0\n
+        maxDepth：大于该深度（米）的点丢弃，为None时不限制
+    '''
+
+    def __init__(self, Q, unitScale=0.001, stride=1, voxelSize=0.0, minDisparity=0, maxDepth=None):
+        self.stride = stride
+        self.voxelSize = voxelSize
+        self.minDisparity = minDisparity
+        self.maxDepth = maxDepth
+        # 把定点视差的1/16、步长和单位换算合并到Q中，reprojectImageTo3D直接使用int16视差和降采样后的坐标
+        self.Q = (np.diag([unitScale, unitScale, unitScale, 1.0]) @ np.asarray(Q, np.float64)
+                  @ np.diag([stride, stride, 1.0 / DISP_SCALE, 1.0]))
+        self._xyz = None   # 复用的重投影结果缓冲区，同一个PointCloudBuilder不能在多个线程中同时使用
+
+    def compute(self, disp, color=None):
+        '''
+        参数：\n
+            disp：SGBM/WLS输出的int16视差图（视差*16）\n
+            color：与视差图对齐的校正后彩色图像 (BGR)，为None时不输出颜色\n
+        返回：(points, colors)，points为 N x 3 float32，colors为 N x 3 uint8 (RGB) 或None
+        '''
+        s = self.stride
+        disp = disp[::s, ::s]
+        self._xyz = cv2.reprojectImageTo3D(disp, self.Q, self._xyz)
+        valid = disp >= max(self.minDisparity * DISP_SCALE, 1)
+        if self.maxDepth is not None:
+            valid &= self._xyz[:, :, 2] <= self.maxDepth
+        points = self._xyz[valid]
+        colors = None
+        if color is not None:
+            colors = color[::s, ::s][valid][:, ::-1]
+        if self.voxelSize > 0 and len(points):
+            keep = voxelDownsample(points, self.voxelSize)
+            points = points[keep]
+            colors = colors[keep] if colors is not None else None
+        return points, np.ascontiguousarray(colors) if colors is not None else None
+
+
+def voxelDownsample(points, voxelSize):
+    """ 体素网格降采样，返回每个体素中第一个点的索引（升序） """
+    cells = np.floor(points / voxelSize).astype(np.int64)
+    cells -= cells.min(axis=0)
+    # 三个方向的体素坐标合并为一个整数键
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, index = np.unique(keys, return_index=True)
+    index.sort()
+    return index
+
+
+def plyHeader(count, hasColor):
+    lines = ['ply', 'format binary_little_endian 1.0', 'element vertex {}'.format(count),
+             'property float x', 'property float y', 'property float z']
+    if hasColor:
+        lines += ['property uchar red', 'property uchar green', 'property uchar blue']
+    lines.append('end_header')
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def vertexArray(points, colors=None):
+    """ 将点和颜色打包为PLY顶点的结构化数组，直接tofile写出 """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), np.dtype(fields))
+    vertices['x'], vertices['y'], vertices['z'] = points[:, 0], points[:, 1], points[:, 2]
+    if colors is not None:
+        vertices['red'], vertices['green'], vertices['blue'] = colors[:, 0], colors[:, 1], colors[:, 2]
+    return vertices
+
+
+def writePly(path, points, colors=None):
+    """ 写出二进制PLY点云 """
+    with open(path, 'wb') as f:
+        f.write(plyHeader(len(points), colors is not None))
+        vertexArray(points, colors).tofile(f)
+
+
+class PointCloudWriter(object):
+    '''
+    逐帧或分批写出点云\n
+    参数：\n
+        outDir：输出文件夹\n
+        format：ply 每批写一个 cloud_<首帧序号>.ply；
+                raw 所有帧追加到 points.f32，每帧为 [int64 帧序号, int64 点数, uint8 是否有颜色 + 7字节填充,
+                点数 x 3 float32, 有颜色时再跟 点数 x 3 uint8]\n
+        batch：每批的帧数，默认为1（逐帧写出）
+    '''
+
+    def __init__(self, outDir='PointCloud', format='ply', batch=1):
+        self.outDir = outDir
+        self.format = format
+        self.batch = batch
+        self._pending = []   # 当前批次中的 (帧序号, points, colors)
+        self._stream = None
+        os.makedirs(outDir, exist_ok=True)
+        if format == 'raw':
+            self._stream = open(os.path.join(outDir, 'points' + CLOUD_FORMATS['raw']), 'ab')
+
+    def write(self, index, points, colors=None):
+        self._pending.append((index, points, colors))
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self.format == 'raw':
+            for index, points, colors in self._pending:
+                header = np.zeros(3, np.int64)
+                header[:2] = index, len(points)
+                header.view(np.uint8)[16] = colors is not None
+                header.tofile(self._stream)
+                np.ascontiguousarray(points, np.float32).tofile(self._stream)
+                if colors is not None:
+                    np.ascontiguousarray(colors, np.uint8).tofile(self._stream)
+            self._stream.flush()
+        else:
+            hasColor = all(colors is not None for _, _, colors in self._pending)
+            points = np.concatenate([p for _, p, _ in self._pending])
+            colors = np.concatenate([c for _, _, c in self._pending]) if hasColor else None
+            writePly(os.path.join(self.outDir, 'cloud_{}'.format(self._pending[0][0]) + CLOUD_FORMATS['ply']), points, colors)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+def readRawStream(path):
+    """ 读取raw格式的点云数据流，逐帧返回 (帧序号, points, colors) """
+    with open(path, 'rb') as f:
+        while True:
+            header = np.fromfile(f, np.int64, 3)
+            if len(header) < 3:
+                return
+            index, count = int(header[0]), int(header[1])
+            hasColor = bool(header.view(np.uint8)[16])
+            points = np.fromfile(f, np.float32, count * 3).reshape(-1, 3)
+            colors = np.fromfile(f, np.uint8, count * 3).reshape(-1, 3) if hasColor else None
+            yield index, points, colors
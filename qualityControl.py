@@ -0,0 +1,139 @@
+#  ==================================================================================
+#  代码描述：自适应质量控制。根据实测的各阶段耗时调整匹配的处理尺度、视差范围、
+#           SGBM模式和WLS开关，使帧率或延迟保持在目标范围内，每次调整都输出日志
+#  ==================================================================================
+
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# 质量等级，从高到低排列，预计耗时依次减小
+#   scale：匹配尺度，小于1时使用金字塔匹配（在缩小的图像上匹配后放大）
+#   range：视差范围相对于配置的numDisparities的比例
+#   mode：SGBM模式，见disparity.SGBM_MODES；为None时使用配置的匹配器后端
+#   wls：是否使用右匹配器 + WLS滤波
+QUALITY_LEVELS = [
+    {'scale': 1.0, 'range': 1.0, 'mode': None, 'wls': True},
+    {'scale': 1.0, 'range': 1.0, 'mode': '3way', 'wls': True},
+    {'scale': 1.0, 'range': 1.0, 'mode': '3way', 'wls': False},
+    {'scale': 0.5, 'range': 1.0, 'mode': '3way', 'wls': True},
+    {'scale': 0.5, 'range': 1.0, 'mode': '3way', 'wls': False},
+    {'scale': 0.5, 'range': 0.5, 'mode': '3way', 'wls': False},
+    {'scale': 0.25, 'range': 1.0, 'mode': '3way', 'wls': False},
+]
+
+
+def levelDisparities(level, numDisparities):
+    """ 质量等级使用的视差范围：按比例缩小，保持为16的倍数 """
+    return max(16, int(np.ceil(numDisparities * level['range'] / 16.0)) * 16)
+
+
+class QualityController(object):
+    '''
+    自适应质量控制器\n
+    每帧调用observe()记录实测耗时，匹配线程每帧调用engine()取得当前的视差计算引擎；
+    统计满window帧后，超出预算时降低一级质量，低于预算的upMargin倍时提高一级质量，
+    切换等级后重新统计\n
+    参数：\n
+        factory：factory(level) 根据质量等级字典创建DisparityEngine\n
+        levels：质量等级列表，从高到低，默认为QUALITY_LEVELS\n
+        targetFps：目标帧率，流水线的帧率受最慢阶段限制，预算为每个阶段 1/targetFps\n
+        latencyBudget：延迟预算（秒），与端到端延迟比较；同时给定时两者都需要满足\n
+        level：初始等级，默认为0（最高质量）\n
+        window：每次决策使用的帧数，默认为10\n
+        upMargin：耗时低于预算的该比例时才提高质量，默认为0.7\n
+        retryInterval：某个等级实测超出预算后，在该时间（秒）内不再提高到该等级，避免在两个等级之间来回切换，默认为30\n
+        log：日志输出函数，默认为print
+    '''
+
+    def __init__(self, factory, levels=QUALITY_LEVELS, targetFps=None, latencyBudget=None, level=0, window=10, upMargin=0.7, retryInterval=30.0, log=print):
+        if targetFps is None and latencyBudget is None:
+            raise ValueError('需要给定targetFps或latencyBudget')
+        self.factory = factory
+        self.levels = list(levels)
+        self.targetFps = targetFps
+        self.latencyBudget = latencyBudget
+        self.window = window
+        self.upMargin = upMargin
+        self.retryInterval = retryInterval
+        self.log = log
+        self.level = level
+        self.changes = []                      # 每次调整的记录
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)   # (最慢阶段耗时, 端到端延迟)
+        self._engine = None
+        self._built = None
+        self._overload = {}                    # 等级 -> 最近一次实测超出预算的时刻
+
+    def observe(self, stageTimes, latency=None, level=None):
+        '''
+        记录一帧的实测耗时（可在任意线程中调用）\n
+        参数：\n
+            stageTimes：各阶段耗时字典，单位秒，如FramePacket.stageTimes\n
+            latency：端到端延迟，单位秒，为None时使用各阶段耗时之和\n
+            level：处理该帧时的质量等级，与当前等级不同时（切换前已在流水线中的帧）忽略
+        '''
+        if not stageTimes or (level is not None and level != self.level):
+            return
+        slowest = max(stageTimes.values())
+        total = sum(stageTimes.values()) if latency is None else latency
+        with self._lock:
+            self._samples.append((slowest, total))
+
+    def load(self):
+        '''
+        当前负载：实测耗时与预算之比的最大值，大于1表示超出预算；样本不足时返回None
+        '''
+        with self._lock:
+            if len(self._samples) < self.window:
+                return None
+            slowest = sum(s for s, _ in self._samples) / len(self._samples)
+            total = sum(t for _, t in self._samples) / len(self._samples)
+        ratios = []
+        if self.targetFps:
+            ratios.append(slowest * self.targetFps)
+        if self.latencyBudget:
+            ratios.append(total / self.latencyBudget)
+        return max(ratios)
+
+    def engine(self):
+        """ 根据最近的统计调整质量等级，返回当前等级的视差计算引擎；应在使用引擎的线程中调用 """
+        load = self.load()
+        if load is not None:
+            now = time.time()
+            if load > 1.0:
+                self._overload[self.level] = now
+                if self.level < len(self.levels) - 1:
+                    self._change(self.level + 1, load)
+            elif load < self.upMargin and self.level > 0:
+                overloaded = self._overload.get(self.level - 1)
+                if overloaded is None or now - overloaded > self.retryInterval:
+                    self._change(self.level - 1, load)
+        if self._built != self.level:
+            if self._engine is not None:
+                self._engine.close()
+            self._engine = self.factory(self.levels[self.level])
+            self._built = self.level
+        return self._engine
+
+    def _change(self, level, load):
+        old = self.levels[self.level]
+        new = self.levels[level]
+        diff = ', '.join('{} {} -> {}'.format(k, old[k], new[k]) for k in new if old.get(k) != new[k])
+        self.log('质量控制：负载 {:.2f}，{} 等级 {} -> {}（{}）'.format(
+            load, '降低' if level > self.level else '提高', self.level, level, diff))
+        self.changes.append({'time': time.time(), 'from': self.level, 'to': level, 'load': load})
+        self.level = level
+        with self._lock:
+            self._samples.clear()
+
+    def current(self):
+        """ 当前质量等级的设置 """
+        return self.levels[self.level]
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.close()
+            self._engine = None
+            self._built = None
@@ -0,0 +1,158 @@
+#  ==================================================================================
+#  代码描述：立体校正器。加载时一次性把浮点映射表转换为所需格式（默认定点CV_16SC2），
+#           之后每帧直接使用缓存的映射表进行remap。
+#           映射表也可以由标定参数按需计算，并以参数哈希为键缓存在磁盘上（LRU淘汰）
+#  ==================================================================================
+
+import os
+import shutil
+import hashlib
+import numpy as np
+import cv2
+from calibrationStore import loadStereoCoefficients, saveStereoMaps, loadStereoMaps
+
+# 可选的映射表格式
+MAP_TYPES = {
+    '32FC1': cv2.CV_32FC1,   # 两张浮点表 (x, y)，精度最高，速度最慢
+    '32FC2': cv2.CV_32FC2,   # 一张双通道浮点表
+    '16SC2': cv2.CV_16SC2,   # 定点格式 (整数坐标 + 插值表索引)，速度最快
+}
+
+# 与映射表一起缓存的校正参数
+RECTIFY_NAMES = ['R1', 'R2', 'P1', 'P2', 'Q', 'roiL', 'roiR']
+
+
+class StereoRectifier(object):
+    '''
+    双目校正器\n
+    参数：\n
+        mapLx, mapLy, mapRx, mapRy：initUndistortRectifyMap生成的CV_32FC1映射表\n
+        mapType：缓存的映射表格式，cv2.CV_16SC2/cv2.CV_32FC2/cv2.CV_32FC1，默认为cv2.CV_16SC2\n
+        interpolation：插值方式，默认为cv2.INTER_LINEAR\n
+        params：校正参数字典 (R1, R2, P1, P2, Q, roiL, roiR)，可作为属性访问
+    '''
+
+    def __init__(self, mapLx, mapLy, mapRx, mapRy, mapType=cv2.CV_16SC2, interpolation=cv2.INTER_LINEAR, params=None):
+        self.mapType = mapType
+        self.interpolation = interpolation
+        self.mapL = convertMap(mapLx, mapLy, mapType)
+        self.mapR = convertMap(mapRx, mapRy, mapType)
+        self.imageSize = (mapLx.shape[1], mapLx.shape[0])
+        params = params or {}
+        for name in RECTIFY_NAMES:
+            setattr(self, name, params.get(name))
+
+    @classmethod
+    def fromFile(cls, path, mapType=cv2.CV_16SC2, interpolation=cv2.INTER_LINEAR):
+        """ 从校正参数文件中加载映射表并转换格式 """
+        coefficients = loadStereoCoefficients(path, True)
+        mapLx, mapLy, mapRx, mapRy = coefficients[-4:]
+        params = dict(zip(RECTIFY_NAMES, coefficients[10:17]))
+        return cls(mapLx, mapLy, mapRx, mapRy, mapType, interpolation, params)
+
+    @classmethod
+    def fromCalibration(cls, path, newImageSize=None, alpha=0, flags=cv2.CALIB_ZERO_DISPARITY, mapType=cv2.CV_16SC2, interpolation=cv2.INTER_LINEAR, cache=None):
+        '''
+        从双目标定文件 (stereoCalibParam.yml) 计算映射表，结果缓存在磁盘上\n
+        参数：\n
+            newImageSize：校正后图像尺寸 (宽, 高)，默认与标定尺寸相同\n
+            alpha, flags：传给cv2.stereoRectify\n
+            cache：RectifyMapCache，默认使用 ./RectifyCache
+        '''
+        imageSize, K1, D1, K2, D2, R, T = loadStereoCoefficients(path, rectifid=False)[:7]
+        if cache is None:
+            cache = RectifyMapCache()
+        maps, params = cache.get(K1, D1, K2, D2, R, T, imageSize, alpha, flags, newImageSize)
+        return cls(maps[0], maps[1], maps[2], maps[3], mapType, interpolation, params)
+
+    def remapLeft(self, image, dst=None):
+        return cv2.remap(image, self.mapL[0], self.mapL[1], self.interpolation, dst=dst)
+
+    def remapRight(self, image, dst=None):
+        return cv2.remap(image, self.mapR[0], self.mapR[1], self.interpolation, dst=dst)
+
+    def remap(self, left, right):
+        """ 校正一对图像 """
+        return self.remapLeft(left), self.remapRight(right)
+
+
+class RectifyMapCache(object):
+    '''
+    校正映射表磁盘缓存\n
+    以标定参数、alpha/flags和输出尺寸的哈希为键，每个键对应 cacheDir/<key>/ 目录，
+    其中映射表保存为.npy（加载时内存映射），校正参数保存为rectify.npz。
+    超过maxEntries时按最近使用时间淘汰\n
+    参数：\n
+        cacheDir：缓存目录，默认为'RectifyCache'\n
+        maxEntries：最多缓存的条目数，默认为4
+    '''
+
+    def __init__(self, cacheDir='RectifyCache', maxEntries=4):
+        self.cacheDir = cacheDir
+        self.maxEntries = maxEntries
+
+    def get(self, K1, D1, K2, D2, R, T, imageSize, alpha=0, flags=cv2.CALIB_ZERO_DISPARITY, newImageSize=None):
+        """ 返回 ([mapLx, mapLy, mapRx, mapRy], params)，缓存未命中时计算并保存 """
+        imageSize = tuple(int(v) for v in imageSize)
+        newImageSize = imageSize if newImageSize is None else tuple(int(v) for v in newImageSize)
+        key = rectifyKey(K1, D1, K2, D2, R, T, imageSize, alpha, flags, newImageSize)
+        entry = os.path.join(self.cacheDir, key)
+
+        if os.path.exists(os.path.join(entry, 'rectify.npz')):
+            # 命中，更新使用时间
+            os.utime(entry, None)
+            with np.load(os.path.join(entry, 'rectify.npz')) as data:
+                params = {name: data[name] for name in RECTIFY_NAMES}
+            return loadStereoMaps(entry), params
+
+        R1, R2, P1, P2, Q, roiL, roiR = cv2.stereoRectify(K1, D1, K2, D2, imageSize, R, T, flags=flags, alpha=alpha, newImageSize=newImageSize)
+        mapLx, mapLy = cv2.initUndistortRectifyMap(K1, D1, R1, P1, newImageSize, cv2.CV_32FC1)
+        mapRx, mapRy = cv2.initUndistortRectifyMap(K2, D2, R2, P2, newImageSize, cv2.CV_32FC1)
+        params = dict(zip(RECTIFY_NAMES, [R1, R2, P1, P2, Q, np.array(roiL), np.array(roiR)]))
+        self._save(entry, [mapLx, mapLy, mapRx, mapRy], params)
+        return [mapLx, mapLy, mapRx, mapRy], params
+
+    def entries(self):
+        """ 按最近使用时间从新到旧排列的缓存目录 """
+        if not os.path.isdir(self.cacheDir):
+            return []
+        entries = [os.path.join(self.cacheDir, name) for name in os.listdir(self.cacheDir)]
+        entries = [e for e in entries if os.path.isdir(e) and not e.endswith('.tmp')]
+        return sorted(entries, key=os.path.getmtime, reverse=True)
+
+    def clear(self):
+        if os.path.isdir(self.cacheDir):
+            shutil.rmtree(self.cacheDir)
+
+    def _save(self, entry, maps, params):
+        # 先写入临时目录再重命名，避免中断时留下不完整的条目
+        tmp = entry + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        saveStereoMaps(tmp, maps)
+        np.savez(os.path.join(tmp, 'rectify.npz'), **params)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(tmp, entry)
+        self._evict()
+
+    def _evict(self):
+        for entry in self.entries()[self.maxEntries:]:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def rectifyKey(K1, D1, K2, D2, R, T, imageSize, alpha, flags, newImageSize):
+    """ 校正参数的哈希值 """
+    h = hashlib.sha1()
+    for m in [K1, D1, K2, D2, R, T]:
+        h.update(np.ascontiguousarray(m, dtype=np.float64).tobytes())
+    h.update(repr((tuple(imageSize), float(alpha), int(flags), tuple(newImageSize))).encode())
+    return h.hexdigest()[:16]
+
+
+def convertMap(mapx, mapy, mapType):
+    """ 将CV_32FC1映射表转换为指定格式，CV_32FC1时原样返回 """
+    if mapType == cv2.CV_32FC1:
+        return mapx, mapy
+    map1, map2 = cv2.convertMaps(mapx, mapy, mapType)
+    return map1, map2
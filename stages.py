@@ -0,0 +1,147 @@
+#  ==================================================================================
+#  代码描述：双目测距流水线的各处理阶段：校正 -> 匹配 -> 后处理 -> 点云（可选）。
+#           main.py和benchmark.py使用同一份代码，性能测试统计的就是实际运行的处理流程
+#  ==================================================================================
+
+import numpy as np
+import cv2
+from disparity import TemporalReuse, timed
+from qualityControl import levelDisparities
+
+
+# 每帧的全部中间结果写入预分配的缓冲区：按分辨率分配一次，帧处理完或被丢弃后归还复用，
+# 左右图为相机采集缓冲区的视图，稳定运行后每帧不再分配新的图像数组
+def makeBuffers(shape):
+    h, w = shape[:2]
+    return {'frame': np.empty((h, w * 2) + tuple(shape[2:]), np.uint8),     # 左右拼接的相机图像（灰度相机时为二维）
+            'camGrayL': np.empty((h, w), np.uint8),
+            'camGrayR': np.empty((h, w), np.uint8),
+            'rectL': np.empty((h, w, 3), np.uint8),
+            'rectR': np.empty((h, w, 3), np.uint8),
+            'leftColor': np.empty((h, w, 3), np.uint8),
+            'grayL': np.empty((h, w), np.uint8),
+            'grayR': np.empty((h, w), np.uint8),
+            'dispL': np.empty((h, w), np.int16),
+            'dispR': np.empty((h, w), np.int16),
+            'filtered': np.empty((h, w), np.int16),
+            'depth': np.empty((h, w), np.float32),
+            'filtU8': np.empty((h, w), np.uint8),
+            'disp': np.empty((h, w), np.float32),
+            'closing': np.empty((h, w), np.float32),
+            'dispC': np.empty((h, w), np.uint8),
+            'dispColor': np.empty((h, w, 3), np.uint8),
+            'filtColor': np.empty((h, w, 3), np.uint8),
+            'colorFilt': np.empty((h * 2, w, 3), np.uint8)}
+
+
+class StereoStages(object):
+    '''
+    流水线的各处理阶段，每个阶段接收FramePacket并返回FramePacket；
+    packet.buffers中有对应的缓冲区时结果写入其中，否则分配新数组\n
+    参数：\n
+        rectifier：StereoRectifier\n
+        matcher：DisparityEngine或TemporalReuse\n
+        depthConverter：DepthConverter\n
+        minDisparity, numDisparities：匹配器的视差范围，用于视差图显示\n
+        grayFirst：先转灰度再只校正单通道图像，默认为True\n
+        remapColor：另外校正彩色左图（packet.rectL，用于点云着色等），默认为False\n
+        quality：QualityController，给定时使用其当前等级的引擎代替matcher\n
+        cloudBuilder, cloudWriter：PointCloudBuilder和PointCloudWriter，给定时增加点云阶段\n
+        cloudColor：点云是否使用校正后的彩色左图着色，默认为True\n
+        kernel：视差图闭运算的结构元素，默认为3x3\n
+        timer：可选的计时器（如benchmark.StageTimer），给定时每个阶段内的每一步单独计时，见disparity.timed()
+    '''
+
+    def __init__(self, rectifier, matcher, depthConverter, minDisparity, numDisparities, grayFirst=True, remapColor=False,
+                 quality=None, cloudBuilder=None, cloudWriter=None, cloudColor=True, kernel=None, timer=None):
+        self.rectifier = rectifier
+        self.matcher = matcher
+        self.depthConverter = depthConverter
+        self.minDisparity = minDisparity
+        self.numDisparities = numDisparities
+        self.grayFirst = grayFirst
+        self.remapColor = remapColor
+        self.quality = quality
+        self.cloudBuilder = cloudBuilder
+        self.cloudWriter = cloudWriter
+        self.cloudColor = cloudColor
+        self.kernel = kernel if kernel is not None else np.ones((3, 3), np.uint8)
+        self.timer = timer
+
+    def stages(self):
+        """ StereoPipeline使用的 [(name, func), ...] """
+        stages = [('rectify', self.rectify), ('match', self.match), ('post', self.post)]
+        if self.cloudWriter is not None:
+            stages.append(('cloud', self.cloud))
+        return stages
+
+    def rectify(self, packet):
+        buf = packet.buffers
+        rectifier = self.rectifier
+        timer = self.timer
+        if self.grayFirst:
+            # 先转灰度再校正单通道图像，remap的工作量约为彩色图像的1/3；灰度相机输出的图像无需转换
+            grayL= packet.left if packet.left.ndim == 2 else timed(timer, 'cvtColorL', cv2.cvtColor, packet.left, cv2.COLOR_BGR2GRAY, buf.get('camGrayL'))
+            grayR= packet.right if packet.right.ndim == 2 else timed(timer, 'cvtColorR', cv2.cvtColor, packet.right, cv2.COLOR_BGR2GRAY, buf.get('camGrayR'))
+            packet.grayL= timed(timer, 'remapL', rectifier.remapLeft, grayL, buf.get('grayL'))
+            packet.grayR= timed(timer, 'remapR', rectifier.remapRight, grayR, buf.get('grayR'))
+            # 只有需要彩色校正图像时（如点云着色）才校正彩色左图
+            packet.rectL= None
+            if self.remapColor and packet.left.ndim == 3:
+                packet.rectL= timed(timer, 'remapColor', rectifier.remapLeft, packet.left, buf.get('rectL'))
+            return packet
+
+        # Rectify the images on rotation and alignement
+        Left_nice= timed(timer, 'remapL', rectifier.remapLeft, packet.left, buf.get('rectL'))  # Rectify the image using the kalibration parameters founds during the initialisation
+        Right_nice= timed(timer, 'remapR', rectifier.remapRight, packet.right, buf.get('rectR'))
+
+        # Convert from color(BGR) to gray
+        packet.grayR= timed(timer, 'cvtColorR', cv2.cvtColor, Right_nice, cv2.COLOR_BGR2GRAY, buf.get('grayR'))
+        packet.grayL= timed(timer, 'cvtColorL', cv2.cvtColor, Left_nice, cv2.COLOR_BGR2GRAY, buf.get('grayL'))
+        packet.rectL= Left_nice
+        return packet
+
+    def match(self, packet):
+        buf = packet.buffers
+        # Compute the 2 images for the Depth_image and apply the WLS filter
+        matcher= self.matcher
+        packet.numDisparities= self.numDisparities
+        if self.quality is not None:
+            matcher= self.quality.engine()
+            packet.qualityLevel= self.quality.level
+            packet.numDisparities= levelDisparities(self.quality.current(), self.numDisparities)
+        packet.filteredImg, packet.dispL, packet.dispR= matcher.compute(packet.grayL,packet.grayR,buf.get('filtered'),buf.get('dispL'),buf.get('dispR'))
+        if isinstance(matcher, TemporalReuse):
+            packet.temporal= dict(matcher.last)   # 变化比例和节省的时间
+        return packet
+
+    def post(self, packet):
+        buf = packet.buffers
+        timer = self.timer
+        # 整帧深度图，单位：米
+        packet.depth = timed(timer, 'depth', self.depthConverter.compute, packet.filteredImg, buf.get('depth'))
+
+        filteredImg = timed(timer, 'normalize', cv2.normalize, packet.filteredImg, buf.get('filtU8'), 255, 0, cv2.NORM_MINMAX, cv2.CV_8U)
+        # (dispL/16 - min_disp)/num_disp, Calculation allowing us to have 0 for the most distant object able to detect
+        packet.disp= timed(timer, 'dispScale', self._scaleDisparity, packet.dispL, packet.numDisparities, buf.get('disp'))
+
+        # Filtering the Results with a closing filter
+        closing= timed(timer, 'morphologyEx', cv2.morphologyEx, packet.disp, cv2.MORPH_CLOSE, self.kernel, buf.get('closing')) # Apply an morphological filter for closing little "black" holes in the picture(Remove noise)
+
+        # Colors map
+        dispC= timed(timer, 'convertScaleAbs', cv2.convertScaleAbs, closing, buf.get('dispC'), 255, -255 * float(closing.min()))  # (closing-closing.min())*255 as uint8, this way you can show the results with the function cv2.imshow()
+        packet.disp_Color= timed(timer, 'colorMapDisp', cv2.applyColorMap, dispC, cv2.COLORMAP_HSV, buf.get('dispColor'))         # Change the Color of the Picture into an Ocean Color_Map
+        filt_Color= timed(timer, 'colorMapFilt', cv2.applyColorMap, filteredImg, cv2.COLORMAP_HSV, buf.get('filtColor'))
+        left= packet.left if packet.left.ndim == 3 else timed(timer, 'cvtColorGray', cv2.cvtColor, packet.left, cv2.COLOR_GRAY2BGR, buf.get('leftColor'))
+        packet.colorFilt = timed(timer, 'vconcat', cv2.vconcat, [filt_Color, left], buf.get('colorFilt'))
+        return packet
+
+    def _scaleDisparity(self, dispL, numDisparities, dst):
+        disp= np.multiply(dispL, np.float32(1.0 / (16 * numDisparities)), out=dst)
+        return np.subtract(disp, np.float32(self.minDisparity / numDisparities), out=disp)
+
+    def cloud(self, packet):
+        # 点云（单位：米），颜色取自校正后的彩色左图
+        packet.points, packet.colors = timed(self.timer, 'pointCloud', self.cloudBuilder.compute, packet.filteredImg, packet.rectL if self.cloudColor else None)
+        timed(self.timer, 'cloudWrite', self.cloudWriter.write, packet.index, packet.points, packet.colors)
+        return packet
@@ -1,37 +1,41 @@
+import os
 import numpy as np
 import cv2
 import argparse
 from monoCalibration import monoCalib
-from calibrationStore import loadCoefficients, saveStereoCoefficients, loadStereoImages
+from calibrationStore import loadCoefficients, saveStereoCoefficients, loadStereoCoefficients, loadStereoImages, savePointStore, loadPointStore
+from cornerDetection import detectCornersBatch
 
 # 终止条件
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 image_size = None
+# 棋盘格检测参数
+DETECT_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_FILTER_QUADS
 
 
-def stereoCalibrate(paramL, paramR, dirL, prefixL, dirR, prefixR, imageFormat, saveFile, squareSize, width=11, height=8):
+def stereoCalibrate(paramL, paramR, dirL, prefixL, dirR, prefixR, imageFormat, saveFile, squareSize, width=11, height=8, workers=None, cacheDir=None):
     """ 双目标定和校正 """
-    objp, leftp, rightp, imageSize = loadImagePoints(dirL, prefixL, dirR, prefixR, imageFormat, squareSize, width, height)
+    objp, leftp, rightp, imageSize = loadImagePoints(dirL, prefixL, dirR, prefixR, imageFormat, squareSize, width, height, workers, cacheDir)
     
     # 获取单目标定参数
     if paramL and paramR: # 从文件中读取
         K1, D1 = loadCoefficients(paramL)
         K2, D2 = loadCoefficients(paramR)
-    else: # 直接利用图片进行标定
-        _,K1, D1, _, _ = monoCalib(dirPath=dirL, prefix=prefixL, imageFormat=imageFormat, saveFile='stereoCalibParamL.yml', squareSize=squareSize, width=width, height=height)
-        _,K2, D2, _, _ = monoCalib(dirPath=dirR, prefix=prefixR, imageFormat=imageFormat, saveFile='stereoCalibParamR.yml', squareSize=squareSize, width=width, height=height)
+    else: # 直接利用图片进行标定，与双目标定使用相同的检测参数，角点缓存中的粗检测结果可以直接复用
+        _,K1, D1, _, _ = monoCalib(dirPath=dirL, prefix=prefixL, imageFormat=imageFormat, saveFile='stereoCalibParamL.yml', squareSize=squareSize, width=width, height=height, workers=workers, flags=DETECT_FLAGS, cacheDir=cacheDir)
+        _,K2, D2, _, _ = monoCalib(dirPath=dirR, prefix=prefixR, imageFormat=imageFormat, saveFile='stereoCalibParamR.yml', squareSize=squareSize, width=width, height=height, workers=workers, flags=DETECT_FLAGS, cacheDir=cacheDir)
 
     flag = 0
     # flag |= cv2.CALIB_FIX_INTRINSIC
     flag |= cv2.CALIB_USE_INTRINSIC_GUESS
     ret, K1, D1, K2, D2, R, T, E, F = cv2.stereoCalibrate(
-        objp, leftp, rightp, K1, D1, K2, D2, imageSize)
+        objp, leftp, rightp, K1, D1, K2, D2, imageSize, flags=flag)
     print("Stereo calibration RMS: ", ret)
 
     saveStereoCoefficients(saveFile, imageSize, K1, D1, K2, D2, R, T, E, F, ret)
 
 
-def loadImagePoints(dirL, prefixL, dirR, prefixR, imageFormat, squareSize,width=11, height=8):
+def loadImagePoints(dirL, prefixL, dirR, prefixR, imageFormat, squareSize,width=11, height=8, workers=None, cacheDir=None):
     pattern_size = (width, height)  # Chessboard size!
     # prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(8,6,0)
     objp = np.zeros((height * width, 3), np.float32)
@@ -39,49 +43,138 @@ def loadImagePoints(dirL, prefixL, dirR, prefixR, imageFormat, squareSize,width=
 
     objp = objp * squareSize  # Create real world coords. Use your metric.
 
+    # 加载立体图像
+    pair_images = list(loadStereoImages(dirL,dirR,imageFormat))
+
+    _, objpoints, imgpointsL, imgpointsR, image_shape = detectImagePoints(pair_images, pattern_size, objp, workers, cacheDir)
+
+    imageSize = image_shape  # If you have no acceptable pair, you may have an error here.
+    print(imageSize)
+    return [objpoints, imgpointsL, imgpointsR, imageSize]
+
+
+def detectImagePoints(pair_images, pattern_size, objp, workers=None, cacheDir=None):
+    """ 检测图片对的角点，返回 [成功的图片对, objpoints, imgpointsL, imgpointsR, 图像尺寸(高, 宽)] """
     # Arrays to store object points and image points from all the images.
+    names = []
     objpoints = []  # 3d point in real world space
     imgpointsL = []  # 2d points in image plane.
     imgpointsR = []  # 2d points in image plane.
+    image_shape = None
 
-    # 加载立体图像
-    pair_images = loadStereoImages(dirL,dirR,imageFormat)
-
-    # Iterate through the pairs and find chessboard corners. Add them to arrays
-    # If openCV can't find the corners in one image, we discard the pair.
-    for left_im, right_im in pair_images:
-        # Right Object Points
-        right = cv2.imread(right_im)
-        gray_right = cv2.cvtColor(right, cv2.COLOR_BGR2GRAY)
-
-        # Find the chess board corners
-        ret_right, corners_right = cv2.findChessboardCorners(gray_right, pattern_size,
-                                                             cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_FILTER_QUADS)
-
-        # Left Object Points
-        left = cv2.imread(left_im)
-        gray_left = cv2.cvtColor(left, cv2.COLOR_BGR2GRAY)
+    imagesL = [left_im for left_im, _ in pair_images]
+    imagesR = [right_im for _, right_im in pair_images]
 
-        # Find the chess board corners
-        ret_left, corners_left = cv2.findChessboardCorners(gray_left, pattern_size,
-                                                           cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_FILTER_QUADS)
+    # 多进程并行检测所有左右图像的角点，结果与图片顺序一致
+    results = detectCornersBatch(imagesL + imagesR, pattern_size, DETECT_FLAGS, (5, 5), workers, cacheDir)
+    resultsL = results[:len(imagesL)]
+    resultsR = results[len(imagesL):]
 
+    # Iterate through the pairs and add the corners to arrays
+    # If openCV can't find the corners in one image, we discard the pair.
+    rejected = []
+    for (left_im, right_im), (ret_left, corners2_left, shape), (ret_right, corners2_right, _) in zip(pair_images, resultsL, resultsR):
         if ret_left and ret_right:
+            if image_shape is not None and shape != image_shape:
+                raise ValueError('图片 {} 的尺寸 {} 与之前图片的尺寸 {} 不一致'.format(left_im, shape, image_shape))
+            names.append((left_im, right_im))
             # Object points
             objpoints.append(objp)
             # Right points
-            corners2_right = cv2.cornerSubPix(gray_right, corners_right, (5, 5), (-1, -1), criteria)
             imgpointsR.append(corners2_right)
             # Left points
-            corners2_left = cv2.cornerSubPix(gray_left, corners_left, (5, 5), (-1, -1), criteria)
             imgpointsL.append(corners2_left)
+            image_shape = shape
         else:
+            rejected.append((left_im, right_im))
             print("Chessboard couldn't detected. Image pair: ", left_im, " and ", right_im)
-            continue
 
-    imageSize = gray_right.shape  # If you have no acceptable pair, you may have an error here.
-    print(imageSize)
-    return [objpoints, imgpointsL, imgpointsR, imageSize]
+    print("检测到角点的图片对: {}/{}，剔除: {}".format(len(objpoints), len(pair_images), len(rejected)))
+    return [names, objpoints, imgpointsL, imgpointsR, image_shape]
+
+
+def incrementalCalibrate(dirL, dirR, imageFormat, saveFile, squareSize, width=11, height=8, pointStore='stereoPoints.npz', initFile='', maxError=1.0, maxIterations=5, minViews=5, workers=None, cacheDir=None):
+    '''
+    增量双目标定\n
+    已检测过的图片对的角点保存在pointStore中，每次只检测新加入的图片对；
+    以initFile中上一次的标定结果 (K1, D1, K2, D2, R, T) 为初值求解，
+    并迭代剔除重投影误差大于maxError的视角（剔除的图片对会被记录，之后不再加入）\n
+    参数：\n
+        pointStore：角点存储文件，默认为'stereoPoints.npz'\n
+        initFile：上一次的双目标定文件，为空或不存在时先由存储的角点做单目标定作为初值\n
+        maxError：单个视角允许的最大重投影误差（像素），默认为1.0\n
+        maxIterations：最多剔除迭代次数，默认为5\n
+        minViews：剔除后至少保留的视角数，默认为5
+    '''
+    pattern_size = (width, height)
+    objp = np.zeros((height * width, 3), np.float32)
+    objp[:, :2] = np.mgrid[0:width, 0:height].T.reshape(-1, 2)
+    objp = objp * squareSize
+
+    # 只检测新的图片对
+    names, objpoints, imgpointsL, imgpointsR, imageShape, rejected, storedSquare, storedPattern = loadPointStore(pointStore)
+    # 存储的角点必须来自相同的棋盘格，否则会与新角点混在一起求解
+    if names:
+        if storedPattern is not None and storedPattern != pattern_size:
+            raise ValueError('角点存储 {} 中的棋盘格角点数为 {}，与当前的 {} 不一致'.format(pointStore, storedPattern, pattern_size))
+        if storedSquare is not None and not np.isclose(storedSquare, squareSize):
+            raise ValueError('角点存储 {} 中的棋盘格尺寸为 {}，与当前的 {} 不一致'.format(pointStore, storedSquare, squareSize))
+        if storedPattern is None or storedSquare is None:
+            print('角点存储 {} 中没有记录棋盘格参数，无法检查是否与当前参数一致'.format(pointStore))
+    known = set(names) | set(rejected)
+    newPairs = [pair for pair in loadStereoImages(dirL, dirR, imageFormat) if tuple(pair) not in known]
+    print("已存储的图片对: {}，新图片对: {}".format(len(names), len(newPairs)))
+    if newPairs:
+        newNames, newObj, newL, newR, newShape = detectImagePoints(newPairs, pattern_size, objp, workers, cacheDir)
+        names += newNames
+        objpoints += newObj
+        imgpointsL += newL
+        imgpointsR += newR
+        if imageShape is not None and newShape is not None and newShape != imageShape:
+            raise ValueError('新图片的尺寸 {} 与角点存储 {} 中的尺寸 {} 不一致'.format(newShape, pointStore, imageShape))
+        imageShape = newShape or imageShape
+        # 未检测到角点的图片对同样记录下来，之后不再检测
+        rejected += [tuple(pair) for pair in newPairs if tuple(pair) not in set(newNames)]
+    if imageShape is None or not objpoints:
+        raise ValueError('没有可用于标定的图片对：存储中没有角点，新图片对中也未检测到完整的棋盘格，请检查图片路径和棋盘格尺寸')
+    size = (imageShape[1], imageShape[0])
+
+    # 初值：上一次的标定结果，或由存储的角点分别做单目标定
+    flags = cv2.CALIB_USE_INTRINSIC_GUESS
+    if initFile and os.path.exists(initFile):
+        _, K1, D1, K2, D2, R, T = loadStereoCoefficients(initFile)[:7]
+        flags |= getattr(cv2, 'CALIB_USE_EXTRINSIC_GUESS', 0)
+    else:
+        _, K1, D1, _, _ = cv2.calibrateCamera(objpoints, imgpointsL, size, None, None)
+        _, K2, D2, _, _ = cv2.calibrateCamera(objpoints, imgpointsR, size, None, None)
+        R = np.eye(3)
+        T = np.zeros((3, 1))
+
+    for iteration in range(maxIterations + 1):
+        # 较新版本的OpenCV还会返回每个视角的rvecs/tvecs，perViewErrors始终为最后一个返回值
+        result = cv2.stereoCalibrateExtended(
+            objpoints, imgpointsL, imgpointsR, K1, D1, K2, D2, size, R, T, flags=flags, criteria=criteria)
+        ret, K1, D1, K2, D2, R, T, E, F = result[:9]
+        perViewErrors = result[-1]
+        print("Stereo calibration RMS: {}  视角数: {}".format(ret, len(objpoints)))
+        errors = perViewErrors.max(axis=1)
+        bad = errors > maxError
+        if iteration == maxIterations or not bad.any() or len(objpoints) - bad.sum() < minViews:
+            break
+        # 剔除误差过大的视角，以当前结果为初值重新求解
+        for i in np.flatnonzero(bad):
+            print("剔除图片对: {} {}  重投影误差: {:.3f}".format(names[i][0], names[i][1], errors[i]))
+            rejected.append(names[i])
+        keep = np.flatnonzero(~bad)
+        names = [names[i] for i in keep]
+        objpoints = [objpoints[i] for i in keep]
+        imgpointsL = [imgpointsL[i] for i in keep]
+        imgpointsR = [imgpointsR[i] for i in keep]
+        flags |= getattr(cv2, 'CALIB_USE_EXTRINSIC_GUESS', 0)
+
+    savePointStore(pointStore, names, objpoints, imgpointsL, imgpointsR, imageShape, rejected, squareSize, pattern_size)
+    saveStereoCoefficients(saveFile, imageShape, K1, D1, K2, D2, R, T, E, F, ret)
+    return [ret, K1, D1, K2, D2, R, T, E, F]
 
 if __name__ == '__main__':
     # Check the help parameters to understand arguments
@@ -97,10 +190,19 @@ if __name__ == '__main__':
     parser.add_argument('--height', type=int, required=False, default=8, help='chessboard height size, default is 8')
     parser.add_argument('--squareSize', type=float, required=False, default=20.0, help='chessboard square size')
     parser.add_argument('--saveFile', type=str, required=False, default='stereoCalibParam.yml', help='YML file to save stereo calibration matrices')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='number of corner detection processes, default is the CPU count')
+    parser.add_argument('--cornerCache', type=str, required=False, default='CornerCache', help='corner detection cache directory, empty to disable')
+    parser.add_argument('--incremental', action='store_true', help='add new image pairs to the stored points and warm-start from the previous calibration')
+    parser.add_argument('--pointStore', type=str, required=False, default='stereoPoints.npz', help='stored calibration points for incremental calibration')
+    parser.add_argument('--initFile', type=str, required=False, default='', help='previous stereo calibration YML file used as initial guess, default is saveFile')
+    parser.add_argument('--maxError', type=float, required=False, default=1.0, help='views with a larger reprojection error are pruned in incremental calibration')
 
     args = parser.parse_args()
     # If chessboard pattern is different, we will pass them as arguments.
-    if args.width is None and args.height is None:
+    if args.incremental:
+        incrementalCalibrate(args.dirL, args.dirR, args.imageFormat, args.saveFile, args.squareSize, args.width, args.height,
+                             args.pointStore, args.initFile or args.saveFile, args.maxError, workers=args.workers, cacheDir=args.cornerCache or None)
+    elif args.width is None and args.height is None:
         stereoCalibrate(args.paramL, args.paramR, args.dirL, args.dirR, args.prefixR, args.imageFormat, args.saveFile, args.squareSize)
     else:
-        stereoCalibrate(args.paramL, args.paramR, args.dirL, args.prefixL, args.dirR, args.prefixR, args.imageFormat, args.saveFile, args.squareSize, args.width, args.height)
\ No newline at end of file
+        stereoCalibrate(args.paramL, args.paramR, args.dirL, args.prefixL, args.dirR, args.prefixR, args.imageFormat, args.saveFile, args.squareSize, args.width, args.height, args.workers, args.cornerCache or None)
\ No newline at end of file
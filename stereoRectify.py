@@ -1,9 +1,22 @@
 import cv2
+import os
+import json
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from calibrationStore import loadStereoCoefficients, saveStereoCoefficients, loadStereoImages
 from capture import makeDir
+from rectifier import StereoRectifier
 
-def rectify(dirL, dirR, imageFormat, loadCalibFile, saveCalibFile):
+# 输出格式对应的扩展名、压缩参数和默认压缩参数值
+CODECS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 1),    # 0-9，越大文件越小、编码越慢
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 95),      # 0-100，越大质量越高
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 95),    # 1-100，大于100为无损
+    'tiff': ('.tiff', None, None),
+}
+
+def rectify(dirL, dirR, imageFormat, loadCalibFile, saveCalibFile, mapFormat='yml'):
 
     # 立体校正
     imageSize, K1, D1, K2, D2, R, T, E, F, rms = loadStereoCoefficients(loadCalibFile, rectifid=False)
@@ -14,7 +27,7 @@ def rectify(dirL, dirR, imageFormat, loadCalibFile, saveCalibFile):
     mapLx, mapLy = cv2.initUndistortRectifyMap(K1, D1, RL, PL, imageSize, cv2.CV_32FC1)
     mapRx, mapRy = cv2.initUndistortRectifyMap(K2, D2, RR, PR, imageSize, cv2.CV_32FC1)
 
-    saveStereoCoefficients(saveCalibFile,  imageSize, K1, D1, K2, D2, R, T, E, F, rms,RL, RR, PL, PR, Q, roiL, roiR, mapLx, mapLy, mapRx, mapRy)
+    saveStereoCoefficients(saveCalibFile,  imageSize, K1, D1, K2, D2, R, T, E, F, rms,RL, RR, PL, PR, Q, roiL, roiR, mapLx, mapLy, mapRx, mapRy, mapFormat)
 
     count = 0
     saveImagesPath = makeDir(numCam=2, path='RectifyData')
@@ -47,6 +60,60 @@ def rectify(dirL, dirR, imageFormat, loadCalibFile, saveCalibFile):
         elif key == 27:
             break
 
+def batchRectify(dirL, dirR, imageFormat, loadCalibFile, savePath='RectifyData', codec='png', level=None, workers=None, maxInFlight=None):
+    '''
+    无界面批量校正，读取、校正和编码在线程池中并行执行（OpenCV在这些操作中释放GIL）\n
+    参数：\n
+        loadCalibFile：双目标定文件，映射表通过RectifyMapCache按需计算\n
+        savePath：输出文件夹前缀，与rectify()相同，结果保存在<savePath>Stereo/left和right中\n
+        codec：输出格式 png/jpg/webp/tiff\n
+        level：压缩参数，png为压缩级别0-9，jpg/webp为质量，为None时使用CODECS中该格式的默认值；tiff没有压缩参数，只能为None\n
+        workers：线程数，默认为CPU核数\n
+        maxInFlight：同时处理的图片对数量上限，用于限制内存占用，默认为2*workers\n
+    每对图片的结果写入 <输出文件夹>/manifest.jsonl
+    '''
+    extension, param, default = CODECS[codec]
+    if param is None and level is not None:
+        raise ValueError('{} 格式没有压缩参数，不能指定level'.format(codec))
+    rectifier = StereoRectifier.fromCalibration(loadCalibFile)
+    saveImagesPath = makeDir(numCam=2, path=savePath)
+    params = [param, default if level is None else level] if param is not None else []
+    workers = workers or os.cpu_count() or 1
+    maxInFlight = maxInFlight or 2 * workers
+    pairs = list(loadStereoImages(dirL, dirR, imageFormat))
+
+    def process(index, imageL, imageR):
+        t0 = time.perf_counter()
+        unrectifyL = cv2.imread(imageL)
+        unrectifyR = cv2.imread(imageR)
+        if unrectifyL is None or unrectifyR is None:
+            return {'index': index, 'left': imageL, 'right': imageR, 'ok': False, 'error': 'read failed'}
+        rectifyL, rectifyR = rectifier.remap(unrectifyL, unrectifyR)
+        outL = saveImagesPath + '/left/' + str(index) + extension
+        outR = saveImagesPath + '/right/' + str(index) + extension
+        ok = cv2.imwrite(outL, rectifyL, params) and cv2.imwrite(outR, rectifyR, params)
+        return {'index': index, 'left': imageL, 'right': imageR, 'rectifiedLeft': outL, 'rectifiedRight': outR,
+                'ok': bool(ok), 'seconds': round(time.perf_counter() - t0, 4)}
+
+    print("开始批量校正 {} 对图片，线程数: {}".format(len(pairs), workers))
+    t0 = time.perf_counter()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(saveImagesPath + '/manifest.jsonl', 'w') as manifest:
+        # 最多同时提交maxInFlight对图片，按顺序写入清单，内存占用与图片总数无关
+        futures = []
+        for index, (imageL, imageR) in enumerate(pairs):
+            futures.append(pool.submit(process, index, imageL, imageR))
+            while len(futures) >= maxInFlight or (index == len(pairs) - 1 and futures):
+                record = futures.pop(0).result()
+                manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+                done += 1
+                failed += 0 if record['ok'] else 1
+                if done % 100 == 0 or done == len(pairs):
+                    elapsed = time.perf_counter() - t0
+                    print("已校正 {}/{} 对图片，失败 {}，{:.1f} 对/秒".format(done, len(pairs), failed, done / elapsed))
+    return done, failed
+
+
 def showRectify(unrectifyL,unrectifyR,rectifyL,rectifyR):
 
     unrectifyLR = cv2.hconcat([unrectifyL, unrectifyR])
@@ -80,7 +147,17 @@ if __name__ == "__main__":
     parser.add_argument('--imageFormat', type=str, required=False, default='png', help='image format, png/jpg')
     parser.add_argument('--loadCalibFile', type=str, required=False, default='./stereoCalibParam.yml', help='name of stereo calibration data YML file')
     parser.add_argument('--saveCalibFile', type=str, required=False, default='./RectifyStereoCalibParam.yml', help='name of rectified YML file')
+    parser.add_argument('--mapFormat', type=str, required=False, default='yml', choices=['yml', 'npy'], help='storage of remap tables, yml (inside the YML file) or npy (binary, memory-mapped on load)')
+    parser.add_argument('--batch', action='store_true', help='rectify all pairs without preview, in parallel')
+    parser.add_argument('--codec', type=str, required=False, default='png', choices=list(CODECS), help='output image codec in batch mode')
+    parser.add_argument('--level', type=int, required=False, default=None, help='png compression level 0-9, or jpg/webp quality, in batch mode (default: 1 for png, 95 for jpg/webp; not available for tiff)')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='number of worker threads in batch mode, default is the CPU count')
 
     args = parser.parse_args()
+    if args.level is not None and CODECS[args.codec][1] is None:
+        parser.error('--level is not supported for --codec {}'.format(args.codec))
 
-    rectify(args.dirL, args.dirR, args.imageFormat, args.loadCalibFile, args.saveCalibFile)
\ No newline at end of file
+    if args.batch:
+        batchRectify(args.dirL, args.dirR, args.imageFormat, args.loadCalibFile, codec=args.codec, level=args.level, workers=args.workers)
+    else:
+        rectify(args.dirL, args.dirR, args.imageFormat, args.loadCalibFile, args.saveCalibFile, args.mapFormat)
\ No newline at end of file